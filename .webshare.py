@@ -2,586 +2,2071 @@
 
 import sys
 import os
-import json
-import zipfile
+import stat
+import io
+import zlib
+import struct
+import socket
+import threading
+import signal
+import select
+import time
+import re
+import itertools
+import bisect
+import base64
 from io import BytesIO
+from datetime import datetime, timezone
+from collections import namedtuple, OrderedDict, deque
+
+try:
+    import fcntl
+except ImportError:  # Not a Unix system
+    fcntl = None
 
 # Python 2 and 3 compatibility
 if sys.version_info[0] == 2:
     from SimpleHTTPServer import SimpleHTTPRequestHandler
     from SocketServer import TCPServer
+    from Queue import Queue
     from urlparse import parse_qs
-    from cgi import FieldStorage
+    from urllib import quote
     input_func = raw_input
 else:
     from http.server import SimpleHTTPRequestHandler
     from socketserver import TCPServer
-    from urllib.parse import parse_qs, unquote
-    from cgi import FieldStorage
+    from queue import Queue
+    from urllib.parse import parse_qs, unquote, quote
     input_func = input
 
-class FileUploadHandler(SimpleHTTPRequestHandler):
-    def do_POST(self):
-        if self.path == '/upload':
-            try:
-                form = FieldStorage(
-                    fp=self.rfile,
-                    headers=self.headers,
-                    environ={
-                        'REQUEST_METHOD': 'POST',
-                        'CONTENT_TYPE': self.headers['Content-Type']
-                    }
-                )
+# Size of the blocks copied between sockets and files
+CHUNK_SIZE = 64 * 1024
 
-                uploaded_files = []
-                if 'file[]' in form:
-                    # Handle multiple files (including directory structure)
-                    items = form['file[]']
-                    if not isinstance(items, list):
-                        items = [items]
-
-                    for item in items:
-                        if hasattr(item, 'filename') and item.filename:
-                            try:
-                                # Create directory structure if needed
-                                filepath = os.path.join(os.getcwd(), item.filename)
-                                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                                
-                                with open(filepath, 'wb') as f:
-                                    f.write(item.file.read())
-                                uploaded_files.append(item.filename)
-                            except OSError as e:
-                                self.send_error_page(
-                                    "Upload Error",
-                                    f"Error uploading {item.filename}",
-                                    str(e),
-                                    "The file might already exist or you don't have permission to write in this location."
-                                )
-                                return
+def gzip_compress(data, level=6):
+    """gzip.compress without importing gzip: zlib writes the gzip wrapper itself"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
 
-                response = '''
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="utf-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <title>Upload Success</title>
-                    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">
-                    <style>
-                        :root {
-                            --bg-color: #1a1b1e;
-                            --card-bg: #25262b;
-                            --text-color: #c1c2c5;
-                            --accent-color: #22c55e;
-                            --border-color: #2c2d31;
-                        }
-                        
-                        body {
-                            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
-                            line-height: 1.5;
-                            color: var(--text-color);
-                            background: var(--bg-color);
-                            margin: 0;
-                            padding: 24px;
-                            font-size: 14px;
-                        }
-                        
-                        .container {
-                            max-width: 600px;
-                            margin: 0 auto;
-                            background: var(--card-bg);
-                            border-radius: 12px;
-                            padding: 24px;
-                            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
-                        }
-                        
-                        .success-icon {
-                            font-size: 48px;
-                            color: var(--accent-color);
-                            margin-bottom: 16px;
-                            text-align: center;
-                        }
-                        
-                        h2 {
-                            color: var(--text-color);
-                            margin: 0 0 16px 0;
-                            text-align: center;
-                        }
-                        
-                        ul {
-                            list-style: none;
-                            padding: 0;
-                            margin: 16px 0;
-                        }
-                        
-                        li {
-                            padding: 8px 0;
-                            border-bottom: 1px solid var(--border-color);
-                        }
-                        
-                        li:last-child {
-                            border-bottom: none;
-                        }
-                        
-                        .btn {
-                            display: inline-flex;
-                            align-items: center;
-                            gap: 8px;
-                            padding: 10px 20px;
-                            font-size: 14px;
-                            font-weight: 500;
-                            color: #fff;
-                            background: var(--accent-color);
-                            border: none;
-                            border-radius: 8px;
-                            cursor: pointer;
-                            text-decoration: none;
-                            transition: all 0.3s ease;
-                        }
-                        
-                        .btn:hover {
-                            opacity: 0.9;
-                            transform: translateY(-1px);
-                        }
-                        
-                        .center {
-                            text-align: center;
-                            margin-top: 24px;
-                        }
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="success-icon">
-                            <i class="fas fa-check-circle"></i>
-                        </div>
-                        <h2>Upload Successful!</h2>
-                '''
-                if len(uploaded_files) > 1:
-                    response += f'<p>{len(uploaded_files)} files were uploaded successfully:</p><ul>'
-                    for f in uploaded_files:
-                        response += f'<li><i class="fas fa-file"></i> {f}</li>'
-                    response += '</ul>'
-                elif len(uploaded_files) == 1:
-                    response += f'<p><i class="fas fa-file"></i> {uploaded_files[0]} was uploaded successfully.</p>'
-                else:
-                    response += '<p>No files were uploaded.</p>'
-                
-                response += '''
-                        <div class="center">
-                            <a href="/" class="btn">
-                                <i class="fas fa-arrow-left"></i> Back to Files
-                            </a>
-                        </div>
-                    </div>
-                </body>
-                </html>'''
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(response.encode())
-                return
-            except Exception as e:
-                self.send_error_page(
-                    "Upload Error",
-                    "Failed to process upload",
-                    str(e),
-                    "There was an error processing your upload request. Please try again."
-                )
-                return
-        elif self.path == '/download-selected':
-            try:
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length).decode('utf-8')
-                files = json.loads(post_data)
-
-                # Create a ZIP file in memory
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for file_path in files:
-                        if os.path.exists(file_path):
-                            if os.path.isdir(file_path):
-                                # Walk through directory
-                                for root, dirs, files in os.walk(file_path):
-                                    for file in files:
-                                        full_path = os.path.join(root, file)
-                                        arcname = os.path.relpath(full_path, os.path.dirname(file_path))
-                                        zip_file.write(full_path, arcname)
-                            else:
-                                # Single file
-                                zip_file.write(file_path, os.path.basename(file_path))
-
-                # Send the ZIP file
-                self.send_response(200)
-                self.send_header('Content-type', 'application/zip')
-                self.send_header('Content-Disposition', 'attachment; filename=\"selected_files.zip\"')
-                self.end_headers()
-                self.wfile.write(zip_buffer.getvalue())
+class ChunkedWriter(object):
+    """Write-only file object sending data as HTTP/1.1 chunks of buffer_size bytes"""
+
+    def __init__(self, wfile, chunked=True, buffer_size=CHUNK_SIZE):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._send()
+        return len(data)
+
+    def flush(self):
+        self._send()
+        self.wfile.flush()
+
+    def _send(self):
+        if not self.buffer:
+            return
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(self.buffer))
+            self.wfile.write(self.buffer)
+            self.wfile.write(b'\r\n')
+        else:
+            self.wfile.write(self.buffer)
+        del self.buffer[:]
+
+    def close(self):
+        if self.closed:
+            return
+        self._send()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+        self.closed = True
+
+class GzipWriter(object):
+    """Write-only file object gzip-compressing into another one, on the fly.
+
+    Unlike GzipStream it compresses in the calling thread and flush() ends
+    the current deflate block (Z_SYNC_FLUSH), so that the client can decode
+    and show everything written so far.
+    """
+
+    def __init__(self, out, level=6):
+        self.out = out
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        self.out.write(self.compressor.compress(data))
+        return len(data)
+
+    def flush(self):
+        self.out.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.out.flush()
+
+    def close(self):
+        self.out.write(self.compressor.flush())
+        self.out.close()
+
+class CountingReader(io.RawIOBase):
+    """Raw reader over a socket counting the bytes received, for io.BufferedReader.
+
+    throttle, if given, is called with the size of everything received and
+    may block to slow the transfer down.
+    """
+
+    def __init__(self, sock, throttle=None):
+        self.sock = sock
+        self.throttle = throttle
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            n = self.sock.recv_into(b)
+        except BlockingIOError:  # non-blocking socket with nothing to read
+            return None
+        self.count += n
+        if n and self.throttle is not None:
+            self.throttle(n)
+        return n
+
+class CountingWriter(io.BufferedIOBase):
+    """Unbuffered socket writer counting the bytes sent, like socketserver's _SocketWriter.
+
+    throttle, if given, is called before each CHUNK_SIZE slice is sent.
+    """
+
+    def __init__(self, sock, throttle=None):
+        self.sock = sock
+        self.throttle = throttle
+        self.count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        with memoryview(b) as view:
+            if self.throttle is None:
+                self.sock.sendall(view)
+            else:
+                for start in range(0, view.nbytes, CHUNK_SIZE):
+                    piece = view[start:start + CHUNK_SIZE]
+                    self.throttle(len(piece))
+                    self.sock.sendall(piece)
+            self.count += view.nbytes
+            return view.nbytes
+
+    def fileno(self):
+        return self.sock.fileno()
+
+# Upper bounds, in seconds, of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Methods reported as such in metrics labels, anything else counts as "other"
+METRICS_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE')
+
+def format_labels(labels):
+    """Render [(name, value), ...] as a Prometheus label set"""
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in labels)
+
+_RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_rate(value):
+    """Bytes per second from '500K', '10M', '1.5G' or a plain number, 0 meaning unlimited"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError('Invalid rate: %r' % (value,))
+    return int(float(match.group(1)) * _RATE_UNITS[match.group(2).upper()])
+
+class TokenBucket(object):
+    """Token bucket shaping a flow to rate bytes per second (0: unlimited).
+
+    consume() reserves tokens under the lock, letting the balance go
+    negative, and sleeps off the deficit outside it. Callers are thus served
+    in reservation order: transfers that each move one CHUNK_SIZE slice at a
+    time get the bandwidth in turn.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            # Up to 100 ms of traffic can be sent in a burst
+            self.burst = max(rate // 10, 2 * CHUNK_SIZE)
+            self.tokens = self.burst
+            self.stamp = time.monotonic()
+
+    def consume(self, n):
+        with self.lock:
+            if not self.rate:
                 return
-            except Exception as e:
-                self.send_error_page(
-                    "Download Error",
-                    "Failed to create download",
-                    str(e),
-                    "There was an error creating the zip file for download. Please try again."
-                )
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+# Bandwidth limits in bytes per second: overall, and for each client address
+BANDWIDTH_LIMITS = ('down', 'up', 'client_down', 'client_up')
+
+class BandwidthLimiter(object):
+    """Global and per-client token buckets for downloads and uploads.
+
+    Limits can be changed at any time with configure(); transfers in
+    progress pick the new rates up on their next slice. With shares server
+    processes, each enforces its part of the global and per-client limits.
+    """
+
+    def __init__(self, limits=None, client_idle=300):
+        self.lock = threading.Lock()
+        self.client_idle = client_idle
+        self.limits = dict.fromkeys(BANDWIDTH_LIMITS, 0)
+        self.shares = 1
+        self.buckets = {'down': TokenBucket(), 'up': TokenBucket()}
+        self.clients = {}  # address -> ({'down': TokenBucket, 'up': TokenBucket}, last use)
+        self.configure(limits or {})
+
+    def configure(self, limits):
+        """Update some of the limits, given as {name: bytes per second or '10M'}"""
+        parsed = {}
+        for name, value in limits.items():
+            if name not in BANDWIDTH_LIMITS:
+                raise ValueError('Unknown limit %r, expected one of %s' % (name, ', '.join(BANDWIDTH_LIMITS)))
+            parsed[name] = parse_rate(value)
+        with self.lock:
+            self.limits.update(parsed)
+            for direction, bucket in self.buckets.items():
+                bucket.set_rate(self._share(direction))
+            for buckets, _ in self.clients.values():
+                for direction, bucket in buckets.items():
+                    bucket.set_rate(self._share('client_' + direction))
+
+    def _share(self, name):
+        rate = self.limits[name]
+        return rate and max(rate // self.shares, 1)
+
+    def split(self, shares):
+        """Share the limits equally between shares processes.
+
+        SO_REUSEPORT spreads the connections of one client over all of them,
+        so the per-client limits are split as well.
+        """
+        with self.lock:
+            self.shares = shares
+        self.configure({})
+
+    def limited(self, direction):
+        return bool(self.limits[direction] or self.limits['client_' + direction])
+
+    def throttle(self, client, direction):
+        """Return a function blocking until n more bytes may be moved for client in direction"""
+        client_limit = 'client_' + direction
+
+        def throttle(n):
+            if self.limits[client_limit]:
+                self._client_bucket(client, direction).consume(n)
+            if self.limits[direction]:
+                self.buckets[direction].consume(n)
+        return throttle
+
+    def _client_bucket(self, client, direction):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.clients.get(client)
+            if entry is None:
+                if len(self.clients) >= 256:
+                    # Forget clients not seen for a while
+                    for address, (_, last_use) in list(self.clients.items()):
+                        if now - last_use > self.client_idle:
+                            del self.clients[address]
+                entry = ({'down': TokenBucket(self._share('client_down')),
+                          'up': TokenBucket(self._share('client_up'))}, now)
+            self.clients[client] = (entry[0], now)
+            return entry[0][direction]
+
+class Histogram(object):
+    """Bucketed observations; callers serialize access (Metrics.lock)"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else '%g' % bound
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + [('le', le)]), cumulative))
+        lines.append('%s_sum%s %r' % (name, format_labels(labels), self.sum))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+        return lines
+
+class Metrics(object):
+    """Process-wide request, transfer, directory walk and cache statistics.
+
+    Rendered in the Prometheus text exposition format by the metrics
+    endpoint. Label values come from small fixed sets (routes, methods,
+    status codes) so the number of series stays bounded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests = {}        # (route, method, code) -> count
+        self.durations = {}       # route -> Histogram
+        self.bytes_sent = {}      # route -> bytes
+        self.bytes_received = {}  # route -> bytes
+        self.walks = {}           # walk -> Histogram
+        self.sections = {}        # timed section of a hot path -> Histogram
+        self.cache = {}           # (cache, result) -> count
+        self.gauges = {'connections': 0, 'in_flight': 0}
+        self.rejected = 0
+
+    def observe_request(self, route, method, code, seconds, sent, received):
+        """Record a finished request, which also leaves the in-flight gauge"""
+        if method not in METRICS_METHODS:
+            method = 'other'
+        with self.lock:
+            key = (route, method, code or 0)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if route not in self.durations:
+                self.durations[route] = Histogram()
+            self.durations[route].observe(seconds)
+            self.bytes_sent[route] = self.bytes_sent.get(route, 0) + sent
+            self.bytes_received[route] = self.bytes_received.get(route, 0) + received
+            self.gauges['in_flight'] -= 1
+
+    def observe_walk(self, walk, seconds):
+        with self.lock:
+            if walk not in self.walks:
+                self.walks[walk] = Histogram()
+            self.walks[walk].observe(seconds)
+
+    def observe_section(self, section, seconds):
+        with self.lock:
+            if section not in self.sections:
+                self.sections[section] = Histogram()
+            self.sections[section].observe(seconds)
+
+    def count_cache(self, cache, result):
+        with self.lock:
+            self.cache[cache, result] = self.cache.get((cache, result), 0) + 1
+
+    def adjust(self, gauge, delta):
+        with self.lock:
+            self.gauges[gauge] += delta
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    def render(self, extra=()):
+        """Return the exposition text, with extra (name, type, help, value) gauges appended"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        with self.lock:
+            family('webshare_requests_total', 'counter', 'HTTP requests served, by route, method and status code.')
+            for (route, method, code), count in sorted(self.requests.items()):
+                lines.append('webshare_requests_total%s %d' % (
+                    format_labels([('route', route), ('method', method), ('code', code)]), count))
+            family('webshare_request_duration_seconds', 'histogram',
+                   'Time from the request line to the end of the response, by route.')
+            for route, histogram in sorted(self.durations.items()):
+                lines.extend(histogram.render('webshare_request_duration_seconds', [('route', route)]))
+            family('webshare_sent_bytes_total', 'counter', 'Bytes sent to clients, headers included, by route.')
+            for route, count in sorted(self.bytes_sent.items()):
+                lines.append('webshare_sent_bytes_total%s %d' % (format_labels([('route', route)]), count))
+            family('webshare_received_bytes_total', 'counter', 'Bytes received from clients, headers included, by route.')
+            for route, count in sorted(self.bytes_received.items()):
+                lines.append('webshare_received_bytes_total%s %d' % (format_labels([('route', route)]), count))
+            family('webshare_connections', 'gauge', 'Client connections being served.')
+            lines.append('webshare_connections %d' % self.gauges['connections'])
+            family('webshare_requests_in_flight', 'gauge', 'Requests being served.')
+            lines.append('webshare_requests_in_flight %d' % self.gauges['in_flight'])
+            family('webshare_rejected_connections_total', 'counter',
+                   'Connections refused with 503 because every worker and queue slot was taken.')
+            lines.append('webshare_rejected_connections_total %d' % self.rejected)
+            family('webshare_dir_walk_duration_seconds', 'histogram',
+                   'Directory walks: listing scans, recursive size lookups and search index refreshes.')
+            for walk, histogram in sorted(self.walks.items()):
+                lines.extend(histogram.render('webshare_dir_walk_duration_seconds', [('walk', walk)]))
+            family('webshare_section_duration_seconds', 'histogram',
+                   'Internal timers around hot paths: listing render, upload parsing, archive streaming, deflate blocks.')
+            for section, histogram in sorted(self.sections.items()):
+                lines.extend(histogram.render('webshare_section_duration_seconds', [('section', section)]))
+            family('webshare_cache_lookups_total', 'counter', 'Cache lookups by cache and result.')
+            for (cache, result), count in sorted(self.cache.items()):
+                lines.append('webshare_cache_lookups_total%s %d' % (
+                    format_labels([('cache', cache), ('result', result)]), count))
+        family('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch, in seconds.')
+        lines.append('process_start_time_seconds %r' % self.start_time)
+        for name, kind, help_text, value in extra:
+            family(name, kind, help_text)
+            lines.append('%s %r' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+class timed(object):
+    """Context manager recording the duration of a hot-path section in METRICS"""
+
+    def __init__(self, section):
+        self.section = section
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        METRICS.observe_section(self.section, time.perf_counter() - self.start)
+
+def format_log_time(timestamp):
+    """ISO 8601 UTC time with milliseconds"""
+    return '%s.%03dZ' % (time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)), timestamp % 1 * 1000)
+
+class AccessLog(object):
+    """JSON-lines access log written by a background thread, rotated to path.1... at max_bytes.
+
+    Records beyond max_pending unwritten ones are dropped and counted rather than slowing requests.
+    """
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backups=5, flush_interval=1.0, max_pending=100000):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.dropped = 0
+        self.ready = threading.Condition(threading.Lock())
+        self.closed = False
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.thread = threading.Thread(target=self._run, name='webshare-access-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, record):
+        """Queue record (a dict) for writing, without blocking on I/O"""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        # deque.append is atomic: no lock on the request path
+        self.pending.append(record)
+
+    def _run(self):
+        while True:
+            with self.ready:
+                self.ready.wait(self.flush_interval)
+                closed = self.closed
+            self._drain()
+            if closed:
+                self.file.close()
                 return
 
-    def send_error_page(self, title, heading, error_message, suggestion):
-        """Send a custom error page"""
-        error_html = f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{title}</title>
-            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">
-            <style>
-                :root {{
-                    --bg-color: #1a1b1e;
-                    --card-bg: #25262b;
-                    --text-color: #c1c2c5;
-                    --error-color: #ef4444;
-                    --border-color: #2c2d31;
-                }}
-                
-                body {{
-                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
-                    line-height: 1.5;
-                    color: var(--text-color);
-                    background: var(--bg-color);
-                    margin: 0;
-                    padding: 24px;
-                    font-size: 14px;
-                }}
-                
-                .container {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background: var(--card-bg);
-                    border-radius: 12px;
-                    padding: 24px;
-                    box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
-                }}
-                
-                .error-icon {{
-                    font-size: 48px;
-                    color: var(--error-color);
-                    margin-bottom: 16px;
-                    text-align: center;
-                }}
-                
-                h2 {{
-                    color: var(--text-color);
-                    margin: 0 0 16px 0;
-                    text-align: center;
-                }}
-                
-                .error-details {{
-                    background: rgba(239, 68, 68, 0.1);
-                    border: 1px solid var(--error-color);
-                    border-radius: 8px;
-                    padding: 16px;
-                    margin: 16px 0;
-                    color: var(--text-color);
-                }}
-                
-                .suggestion {{
-                    color: #6b7280;
-                    margin: 16px 0;
-                    padding: 16px;
-                    border-left: 4px solid var(--border-color);
-                }}
-                
-                .btn {{
-                    display: inline-flex;
-                    align-items: center;
-                    gap: 8px;
-                    padding: 10px 20px;
-                    font-size: 14px;
-                    font-weight: 500;
-                    color: #fff;
-                    background: var(--error-color);
-                    border: none;
-                    border-radius: 8px;
-                    cursor: pointer;
-                    text-decoration: none;
-                    transition: all 0.3s ease;
-                }}
-                
-                .btn:hover {{
-                    opacity: 0.9;
-                    transform: translateY(-1px);
-                }}
-                
-                .center {{
-                    text-align: center;
-                    margin-top: 24px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="error-icon">
-                    <i class="fas fa-exclamation-circle"></i>
-                </div>
-                <h2>{heading}</h2>
-                <div class="error-details">
-                    <strong>Error:</strong> {error_message}
-                </div>
-                <div class="suggestion">
-                    <i class="fas fa-lightbulb"></i> {suggestion}
-                </div>
-                <div class="center">
-                    <a href="/" class="btn">
-                        <i class="fas fa-arrow-left"></i> Back to Files
-                    </a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-        
-        self.send_response(500)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(error_html.encode())
+    def _drain(self):
+        import json
+        lines = []
+        while self.pending:
+            record = self.pending.popleft()
+            # Formatted here rather than on the request path
+            record['time'] = format_log_time(record['time'])
+            lines.append(json.dumps(record, separators=(',', ':')))
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(json.dumps({'time': format_log_time(time.time()), 'dropped': dropped}))
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        try:
+            if self.size and self.size + len(data) > self.max_bytes:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+        except OSError as e:
+            sys.stderr.write('Access log write failed: %s\n' % e)
 
-    def list_directory(self, path):
+    def _rotate(self):
+        self.file.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists('%s.%d' % (self.path, i)):
+                    os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'wb')
+        self.size = 0
+
+    def close(self):
+        """Write out what is queued and stop the writer thread"""
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.thread.join()
+
+class RequestProfiler(object):
+    """Profile every Nth request of routes, dumping per-route stats under directory.
+
+    mode is 'cprofile' (pstats, one request at a time) or 'sample' (collapsed stacks).
+    """
+
+    def __init__(self, directory, mode='cprofile', routes=None, every=1, interval=0.005, dump_interval=10):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.mode = mode
+        self.routes = set(routes) if routes else None
+        self.every = every
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()  # held while a cProfile runs
+        self.stats = {}      # route -> pstats.Stats
+        self.stacks = {}     # route -> {collapsed stack: samples}
+        self.active = {}     # thread ident -> {collapsed stack: samples}, sample mode
+        self.requests = {}   # route -> profiled requests
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='webshare-profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def begin(self):
+        """Start profiling the current request if it is selected, returning a token for end()"""
+        with self.lock:
+            if next(self.counter) % self.every:
+                return None
+        if self.mode == 'sample':
+            ident = threading.get_ident()
+            self.active[ident] = {}
+            return ident
+        if not self.profiling.acquire(False):
+            return None
+        import cProfile
+        profile = cProfile.Profile()
         try:
-            list = os.listdir(path)
-        except OSError:
-            self.send_error(404, 'No permission to list directory')
+            profile.enable()
+        except ValueError:  # another profiler is active
+            self.profiling.release()
             return None
-        
-        list.sort(key=lambda a: a.lower())
-        
-        r = []
-        r.append('<!DOCTYPE html>')
-        r.append('<html>')
-        r.append('<head>')
-        r.append('    <meta charset="utf-8">')
-        r.append('    <meta name="viewport" content="width=device-width, initial-scale=1.0">')
-        r.append('    <title>WebShare</title>')
-        r.append('    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">')
-        r.append(r'''    <style>
-        :root {
-            --bg-color: #1a1b1e;
-            --card-bg: #25262b;
-            --text-color: #c1c2c5;
-            --accent-color: #3b82f6;
-            --border-color: #2c2d31;
-            --hover-bg: #2c2d31;
-            --danger-color: #ef4444;
-            --success-color: #22c55e;
-            --folder-color: #3b82f6;
-            --file-color: #94a3b8;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
-            line-height: 1.5;
-            color: var(--text-color);
-            background: var(--bg-color);
-            font-size: 14px;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 24px;
-        }
-        
-        .header {
-            background: var(--card-bg);
-            padding: 24px;
-            border-radius: 12px;
-            margin-bottom: 24px;
-            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            flex-wrap: wrap;
-            gap: 16px;
-        }
-        
-        .header h1 {
-            font-size: 24px;
-            font-weight: 600;
-            color: var(--text-color);
-            display: flex;
-            align-items: center;
-            gap: 12px;
-            margin: 0;
-        }
-        
-        .header h1 i {
-            color: var(--accent-color);
-        }
+        return profile
 
-        .server-info {
-            display: flex;
-            align-items: center;
-            gap: 24px;
-            color: #6b7280;
-            font-size: 14px;
-        }
+    def end(self, token, route):
+        """Stop profiling for token and keep the result if route is selected"""
+        if self.mode == 'sample':
+            samples = self.active.pop(token, {})
+        else:
+            token.disable()
+            self.profiling.release()
+        if self.routes is not None and route not in self.routes:
+            return
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            if self.mode == 'sample':
+                stacks = self.stacks.setdefault(route, {})
+                for stack, count in samples.items():
+                    stacks[stack] = stacks.get(stack, 0) + count
+            elif route in self.stats:
+                self.stats[route].add(token)
+            else:
+                import pstats
+                self.stats[route] = pstats.Stats(token)
 
-        .server-info span {
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }
+    def _run(self):
+        next_dump = time.time() + self.dump_interval
+        while not self.closed.wait(self.interval if self.mode == 'sample' else 1):
+            if self.mode == 'sample':
+                self._sample()
+            if time.time() >= next_dump:
+                self.dump()
+                next_dump = time.time() + self.dump_interval
 
-        .server-info i {
-            font-size: 14px;
-            opacity: 0.8;
-        }
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, samples in list(self.active.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            samples[key] = samples.get(key, 0) + 1
 
-        .server-info .hostname {
-            color: var(--accent-color);
-            font-weight: 500;
-        }
+    def dump(self):
+        """Write the aggregated results collected so far"""
+        with self.lock:
+            requests = dict(self.requests)
+            stats = dict(self.stats)
+            stacks = dict((route, dict(samples)) for route, samples in self.stacks.items())
+            for route, route_stats in stats.items():
+                self._write(route + '.prof', route_stats.dump_stats)
+                out = io.StringIO()
+                out.write('%d profiled requests\n' % requests.get(route, 0))
+                route_stats.stream = out
+                route_stats.sort_stats('cumulative').print_stats(60)
+                self._write_text(route + '.txt', out.getvalue())
+        for route, samples in stacks.items():
+            self._write_text(route + '.collapsed', ''.join(
+                '%s %d\n' % (stack, count) for stack, count in sorted(samples.items())))
+        self._write_text('timers.txt', self._timers())
 
-        .server-info .path {
-            color: var(--success-color);
-            font-weight: 500;
-            word-break: break-all;
-        }
-        
-        .upload-zone {
-            background: var(--card-bg);
-            border: 2px dashed var(--border-color);
-            border-radius: 12px;
-            padding: 32px;
-            text-align: center;
-            margin-bottom: 24px;
-            transition: all 0.3s ease;
-            position: relative;
-        }
-        
-        .upload-zone:hover, .upload-zone.dragover {
-            border-color: var(--accent-color);
-            background: rgba(59, 130, 246, 0.05);
-        }
-        
-        .upload-zone i {
-            font-size: 48px;
-            color: var(--text-color);
-            margin-bottom: 16px;
-            opacity: 0.8;
-        }
-        
-        .upload-zone h3 {
-            font-size: 18px;
-            margin-bottom: 8px;
-            color: var(--text-color);
-        }
-        
-        .upload-zone p {
-            color: #6b7280;
-            margin-bottom: 24px;
-        }
+    def _timers(self):
+        lines = ['%-28s %10s %12s %12s' % ('section', 'count', 'total ms', 'mean ms')]
+        with METRICS.lock:
+            sections = [('walk:' + name, h) for name, h in sorted(METRICS.walks.items())]
+            sections += sorted(METRICS.sections.items())
+            for name, histogram in sections:
+                count = sum(histogram.counts)
+                lines.append('%-28s %10d %12.1f %12.3f' % (
+                    name, count, histogram.sum * 1000, histogram.sum * 1000 / count if count else 0))
+        return '\n'.join(lines) + '\n'
 
-        .upload-zone form {
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 16px;
-        }
+    def _write(self, name, dump):
+        # Through a temporary file, so a reader never sees a partial dump
+        path = os.path.join(self.directory, name)
+        dump(path + '.tmp')
+        os.replace(path + '.tmp', path)
 
-        .upload-zone input[type="file"] {
-            display: none;
-        }
+    def _write_text(self, name, text):
+        def dump(path):
+            with open(path, 'w') as f:
+                f.write(text)
+        self._write(name, dump)
 
-        .upload-btn, .file-input-label {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            padding: 0 24px;
-            font-size: 14px;
-            font-weight: 500;
-            border-radius: 8px;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            height: 42px;
-            min-width: 140px;
-        }
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.dump()
 
-        .upload-btn {
-            color: #fff;
-            background: linear-gradient(45deg, var(--accent-color), #2563eb);
-            border: none;
-            box-shadow: 0 4px 6px -1px rgba(59, 130, 246, 0.2);
-        }
-        
-        .upload-btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 8px -1px rgba(59, 130, 246, 0.3);
-            background: linear-gradient(45deg, #2563eb, #1d4ed8);
-        }
-        
-        .upload-btn:active {
-            transform: translateY(0);
-            box-shadow: 0 2px 4px -1px rgba(59, 130, 246, 0.2);
-        }
-        
-        .upload-btn i {
-            font-size: 16px;
-            color: #fff;
-            margin-bottom: 4px;
-        }
+class DirSizeIndex(object):
+    """Persistent recursive directory sizes in SQLite, revalidated by directory mtime.
 
-        .file-input-label {
-            color: var(--text-color);
-            background: var(--hover-bg);
-            border: 1px solid var(--border-color);
+    Results younger than max_age seconds are trusted without revisiting the
+    subtree. Each directory row is committed on its own, so a walk never holds
+    the database lock that other server processes wait for; a busy or broken
+    database counts as a cache miss.
+    """
+
+    def __init__(self, db_path, max_age=30, timeout=2, retry_interval=30):
+        import sqlite3
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # After an error the index is skipped for retry_interval seconds
+        self.retry_interval = retry_interval
+        self.retry_at = 0
+        self.db = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT NOT NULL,
+            dev INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            own_size INTEGER NOT NULL,
+            total_size INTEGER NOT NULL,
+            checked REAL NOT NULL
+        )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+        self.db.commit()
+
+    def size(self, path, st=None):
+        """Return the total size of the files below path, st being its stat if known"""
+        path = os.path.abspath(path)
+        return self._size(path, st or os.stat(path), time.time())
+
+    def cached(self, path, st):
+        """Whether size(path, st) is answered without walking the subtree"""
+        rows = self._query('SELECT dev, ino, mtime_ns, checked FROM dirs WHERE path = ?',
+                           (os.path.abspath(path),))
+        return (bool(rows) and rows[0][:3] == (st.st_dev, st.st_ino, st.st_mtime_ns)
+                and time.time() - rows[0][3] < self.max_age)
+
+    def _query(self, sql, params):
+        """Rows of a read, None while the database is unavailable"""
+        import sqlite3
+        if time.monotonic() < self.retry_at:
+            return None
+        try:
+            with self.lock:
+                return self.db.execute(sql, params).fetchall()
+        except sqlite3.Error:
+            self._unavailable()
+            return None
+
+    def _write(self, sql, params):
+        """Run and commit one statement, skipped while the database is unavailable"""
+        import sqlite3
+        if time.monotonic() < self.retry_at:
+            return
+        try:
+            with self.lock, self.db:
+                self.db.execute(sql, params)
+        except sqlite3.Error:
+            self._unavailable()
+
+    def _unavailable(self):
+        self.retry_at = time.monotonic() + self.retry_interval
+        METRICS.count_cache('dir_size', 'unavailable')
+
+    def _size(self, path, st, now):
+        rows = self._query(
+            'SELECT dev, ino, mtime_ns, own_size, total_size, checked FROM dirs WHERE path = ?',
+            (path,))
+        row = rows[0] if rows else None
+        unchanged = row is not None and row[:3] == (st.st_dev, st.st_ino, st.st_mtime_ns)
+        if unchanged and now - row[5] < self.max_age:
+            METRICS.count_cache('dir_size', 'hit')
+            return row[4]
+
+        subdirs = None
+        if unchanged:
+            own_size = row[3]
+            rows = self._query('SELECT path FROM dirs WHERE parent = ?', (path,))
+            if rows is not None:
+                METRICS.count_cache('dir_size', 'revalidated')
+                subdirs = [r[0] for r in rows]
+        if subdirs is None:
+            METRICS.count_cache('dir_size', 'miss')
+            own_size, subdirs = self._scan(path)
+            self._forget_removed(path, subdirs)
+
+        total_size = own_size
+        for subdir in subdirs:
+            try:
+                total_size += self._size(subdir, os.stat(subdir), now)
+            except OSError:
+                self._forget(subdir)
+        self._write('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, os.path.dirname(path), st.st_dev, st.st_ino, st.st_mtime_ns,
+                     own_size, total_size, now))
+        return total_size
+
+    def _scan(self, path):
+        """Return (sum of file sizes, subdirectories) for the direct content of path"""
+        own_size = 0
+        subdirs = []
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return 0, subdirs
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    # Same accounting as os.walk + os.path.getsize: links to files count
+                    own_size += entry.stat().st_size
+            except OSError:
+                pass
+        return own_size, subdirs
+
+    def _forget_removed(self, path, subdirs):
+        current = set(subdirs)
+        for row in self._query('SELECT path FROM dirs WHERE parent = ?', (path,)) or ():
+            if row[0] not in current:
+                self._forget(row[0])
+
+    def _forget(self, path):
+        """Drop path and everything indexed below it"""
+        # '0' sorts right after '/', so this range covers exactly path/...
+        self._write('DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)',
+                    (path, path + '/', path + '0'))
+
+def default_size_index_path():
+    return os.path.join(default_cache_dir(), 'sizes.db')
+
+# Checksums of the checksums API: sha256 for verification with sha256sum,
+# crc32 (zlib) when a fast check against transfer errors is enough
+CHECKSUM_ALGORITHMS = ('sha256', 'crc32')
+CHECKSUM_READ_SIZE = 1024 * 1024
+
+def file_checksum(path, algorithm):
+    """Return (hex digest, stat) of the regular file at path.
+
+    The stat is None when the file changed while it was read: the digest
+    is then not worth caching. hashlib and zlib release the GIL on large
+    blocks, so several files hash in parallel on a thread pool.
+    """
+    buffer = bytearray(CHECKSUM_READ_SIZE)
+    view = memoryview(buffer)
+    with timed('checksum'), open(path, 'rb') as f:
+        before = os.fstat(f.fileno())
+        if algorithm == 'sha256':
+            import hashlib
+            digest = hashlib.sha256()
+            for n in iter(lambda: f.readinto(buffer), 0):
+                digest.update(view[:n])
+            value = digest.hexdigest()
+        else:
+            crc = 0
+            for n in iter(lambda: f.readinto(buffer), 0):
+                crc = zlib.crc32(view[:n], crc)
+            value = '%08x' % crc
+        after = os.fstat(f.fileno())
+    if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+        return value, None
+    return value, after
+
+class ChecksumCache(object):
+    """Persistent file checksums, stored in SQLite.
+
+    Rows are keyed by device, inode and algorithm, and only trusted while
+    the file keeps the size and mtime it had when it was hashed: verifying
+    unchanged files again costs one stat each.
+    """
+
+    def __init__(self, db_path, timeout=2, retry_interval=30):
+        import sqlite3
+        self.lock = threading.Lock()
+        # After an error the cache is skipped for retry_interval seconds
+        self.retry_interval = retry_interval
+        self.retry_at = 0
+        # Short lock timeout: when the database is busy, hashing again beats waiting
+        self.db = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS checksums (
+            dev INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            PRIMARY KEY (dev, ino, algorithm)
+        )''')
+        self.db.commit()
+
+    def get(self, st, algorithm):
+        """Return the cached checksum of the file with stat st, None if unknown or stale"""
+        import sqlite3
+        row = None
+        if time.monotonic() >= self.retry_at:
+            try:
+                with self.lock:
+                    row = self.db.execute(
+                        'SELECT size, mtime_ns, checksum FROM checksums WHERE dev = ? AND ino = ? AND algorithm = ?',
+                        (st.st_dev, st.st_ino, algorithm)).fetchone()
+            except sqlite3.Error:
+                self.retry_at = time.monotonic() + self.retry_interval
+                raise
+        if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+            METRICS.count_cache('checksum', 'hit')
+            return row[2]
+        METRICS.count_cache('checksum', 'miss')
+        return None
+
+    def put(self, st, algorithm, checksum):
+        """Record a checksum, committed at once: other server processes share the database"""
+        import sqlite3
+        if time.monotonic() < self.retry_at:
+            return
+        try:
+            with self.lock, self.db:
+                self.db.execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)',
+                                (st.st_dev, st.st_ino, algorithm, st.st_size, st.st_mtime_ns, checksum))
+        except sqlite3.Error:
+            self.retry_at = time.monotonic() + self.retry_interval
+            raise
+
+def default_checksum_cache_path():
+    return os.path.join(default_cache_dir(), 'checksums.db')
+
+def glob_to_regex(pattern):
+    """Translate a glob into a regex to fullmatch against a relative path.
+
+    '*' and '?' stay within one path component, '**' crosses them. A pattern
+    without '/' is matched against the last component only.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', r'\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append('[%s]' % body)
+            i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    prefix = '' if '/' in pattern else '(?:.*/)?'
+    try:
+        return re.compile(prefix + ''.join(parts), re.DOTALL)
+    except re.error as e:  # e.g. a reversed range such as [z-a]
+        raise ValueError('invalid pattern: %s' % e)
+
+def glob_literal(pattern):
+    """Longest run of plain characters in a glob, usable to prefilter with str.find"""
+    return max(re.split(r'\*|\?|\[.[^\]]*\]', pattern), key=len)
+
+class FilenameIndex(object):
+    """In-memory index of every path below root, for recursive name search.
+
+    A background thread walks the tree and then re-stats every directory
+    each interval seconds, re-listing only those whose mtime changed. The
+    searchable form is one newline-separated string of lowercased relative
+    paths, so substring and glob queries run inside str.find and re rather
+    than in a Python loop.
+    """
+
+    def __init__(self, root, interval=60):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        # Relative directory path -> (mtime_ns, [(name, is_dir), ...])
+        self.dirs = {}
+        self.ready = False
+        # (paths, is_dir flags, blob, line start offsets), swapped as a whole
+        self.snapshot = ([], [], '', [])
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the indexing thread, unless it already runs"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='webshare-search-index')
+                self.thread.daemon = True
+                self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                sys.stderr.write('Search index refresh failed: %s\n' % e)
+            self.ready = True
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """Bring the index up to date, returning whether anything changed"""
+        start = time.perf_counter()
+        try:
+            return self._refresh()
+        finally:
+            METRICS.observe_walk('search_index', time.perf_counter() - start)
+
+    def _refresh(self):
+        changed = False
+        seen = set()
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                continue
+            seen.add(rel)
+            cached = self.dirs.get(rel)
+            if cached is None or cached[0] != st.st_mtime_ns:
+                names = []
+                try:
+                    with os.scandir(os.path.join(self.root, rel)) as it:
+                        for entry in it:
+                            try:
+                                names.append((entry.name, entry.is_dir(follow_symlinks=False)))
+                            except OSError:
+                                pass
+                except OSError:
+                    pass
+                cached = self.dirs[rel] = (st.st_mtime_ns, names)
+                changed = True
+            for name, is_dir in cached[1]:
+                if is_dir:
+                    stack.append(os.path.join(rel, name))
+        for rel in set(self.dirs) - seen:
+            del self.dirs[rel]
+            changed = True
+        if changed:
+            self._rebuild()
+        return changed
+
+    def _rebuild(self):
+        paths = []
+        flags = []
+        for rel in sorted(self.dirs):
+            for name, is_dir in self.dirs[rel][1]:
+                paths.append(os.path.join(rel, name))
+                flags.append(is_dir)
+        lines = [path.lower() for path in paths]
+        offsets = [0]
+        offsets.extend(itertools.accumulate(len(line) + 1 for line in lines))
+        offsets.pop()
+        self.snapshot = (paths, flags, '\n'.join(lines), offsets)
+
+    def search(self, query, limit=200):
+        """Return ([(relative path, is_dir), ...], truncated) for a substring or glob query"""
+        paths, flags, blob, offsets = self.snapshot
+        query = query.lower()
+        if any(c in query for c in '*?['):
+            regex = glob_to_regex(query)
+            literal = glob_literal(query)
+        else:
+            regex = None
+            literal = query
+        if literal:
+            lines = self._lines_containing(blob, offsets, literal)
+        else:
+            lines = range(len(paths))
+        results = []
+        for line in lines:
+            if regex is not None:
+                end = offsets[line + 1] - 1 if line + 1 < len(offsets) else len(blob)
+                if not regex.fullmatch(blob, offsets[line], end):
+                    continue
+            if len(results) == limit:
+                return results, True
+            results.append((paths[line], flags[line]))
+        return results, False
+
+    @staticmethod
+    def _lines_containing(blob, offsets, literal):
+        """Yield the index of each line of blob containing literal"""
+        if '\n' in literal:
+            return
+        position = blob.find(literal)
+        while position >= 0:
+            line = bisect.bisect_right(offsets, position) - 1
+            yield line
+            # One hit per line is enough: resume at the next one
+            if line + 1 >= len(offsets):
+                return
+            position = blob.find(literal, offsets[line + 1])
+
+    def __len__(self):
+        return len(self.snapshot[0])
+
+# Default and bounds of the chunk size of resumable uploads
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_UPLOAD_CHUNK_SIZE = 256 * 1024 * 1024
+
+class FileLock(object):
+    """Exclusive flock on path while in the with block, shared with other processes"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)  # Releases the lock
+
+class UploadSession(object):
+    """A resumable upload, written chunk by chunk into a hidden file next to its destination.
+
+    Chunks may arrive in any order and in parallel: each one is written at
+    its offset with os.pwrite. The list of received chunks is saved in
+    state_path after every chunk so the upload can resume after a restart.
+    Chunks may also go to different server processes (--processes): saving
+    merges the chunks the others recorded, under a lock on the state file.
+    """
+
+    def __init__(self, upload_id, path, size, chunk_size, state_path, received=()):
+        self.upload_id = upload_id
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.state_path = state_path
+        self.part_path = os.path.join(os.path.dirname(path),
+                                      '.%s.%s.part' % (os.path.basename(path), upload_id))
+        self.received = set(received)
+        self.lock = threading.Lock()
+
+    @property
+    def chunk_count(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def missing(self):
+        return [index for index in range(self.chunk_count) if index not in self.received]
+
+    def status(self, root):
+        return {
+            'id': self.upload_id,
+            'path': os.path.relpath(self.path, root),
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunk_count,
+            'received': sorted(self.received),
         }
 
-        .file-input-label:hover {
-            background: var(--card-bg);
-            border-color: var(--accent-color);
-            transform: translateY(-2px);
+    def prepare(self):
+        """Create the part file at its final size, keeping data already received"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def write_chunk(self, offset, rfile, length):
+        """Copy one chunk of length bytes from rfile to offset"""
+        if offset % self.chunk_size or not 0 <= offset < max(self.size, 1):
+            raise ValueError('Offset %d is not the start of a chunk' % offset)
+        index = offset // self.chunk_size
+        if length != min(self.chunk_size, self.size - offset):
+            raise ValueError('Chunk %d must be %d bytes' % (index, min(self.chunk_size, self.size - offset)))
+        fd = os.open(self.part_path, os.O_WRONLY)
+        try:
+            position = offset
+            remaining = length
+            while remaining > 0:
+                data = rfile.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise ValueError('Upload interrupted: connection closed in the middle of chunk %d' % index)
+                while data:
+                    written = os.pwrite(fd, data, position)
+                    data = data[written:]
+                    position += written
+                remaining = offset + length - position
+        finally:
+            os.close(fd)
+        with self.lock:
+            self.received.add(index)
+            self.save()
+
+    def refresh(self):
+        """Add the chunks other processes received to self.received"""
+        import json
+        try:
+            with open(self.state_path) as f:
+                received = json.load(f)['received']
+        except (OSError, ValueError, KeyError):
+            return
+        with self.lock:
+            self.received.update(received)
+
+    def save(self):
+        with FileLock(self.state_path + '.lock'):
+            self._save()
+
+    def _save(self):
+        import json
+        try:
+            with open(self.state_path) as f:
+                self.received.update(json.load(f)['received'])
+        except (OSError, ValueError, KeyError):
+            pass
+        state = {
+            'id': self.upload_id,
+            'path': self.path,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'received': sorted(self.received),
         }
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
 
-        .file-input-label i {
-            font-size: 16px;
-            color: var(--accent-color);
-            margin-bottom: 4px;
+    def commit(self):
+        self.refresh()
+        missing = self.missing()
+        if missing:
+            raise ValueError('%d chunk(s) still missing, first one is %d' % (len(missing), missing[0]))
+        os.replace(self.part_path, self.path)
+        self._remove_state()
+
+    def abort(self):
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+        self._remove_state()
+
+    def _remove_state(self):
+        for path in (self.state_path, self.state_path + '.lock'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class UploadSessions(object):
+    """Registry of UploadSessions, their state kept as JSON files in state_dir"""
+
+    def __init__(self, state_dir, root):
+        self.state_dir = state_dir
+        self.root = root
+        self.sessions = {}
+        self.lock = threading.Lock()
+        private_directory(state_dir)
+
+    def create(self, path, size, fingerprint, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Start an upload of path, relative to root, or return the pending one for the same file"""
+        import hashlib
+        import json
+        if size < 0:
+            raise ValueError('Invalid size')
+        chunk_size = min(max(chunk_size, MIN_UPLOAD_CHUNK_SIZE), MAX_UPLOAD_CHUNK_SIZE)
+        path = contained_path(self.root, path)
+        key = json.dumps([path, size, chunk_size, fingerprint])
+        upload_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]
+        try:
+            session = self.get(upload_id)
+        except LookupError:
+            session = UploadSession(upload_id, path, size, chunk_size, self._state_path(upload_id))
+            session.prepare()
+            session.save()
+            with self.lock:
+                self.sessions[upload_id] = session
+            return session
+        # Resuming: the data may have been removed since
+        if not os.path.exists(session.part_path):
+            session.received.clear()
+        session.prepare()
+        return session
+
+    def get(self, upload_id):
+        """Return a session by id, loading it from state_dir after a restart"""
+        import json
+        if not re.match(r'^[0-9a-f]{32}$', upload_id):
+            raise LookupError('Unknown upload session')
+        with self.lock:
+            session = self.sessions.get(upload_id)
+            if session is not None:
+                # Chunks may have been received by another server process
+                session.refresh()
+            else:
+                try:
+                    with open(self._state_path(upload_id)) as f:
+                        state = json.load(f)
+                    path = contained_path(self.root, state['path'])
+                    session = UploadSession(upload_id, path, int(state['size']), int(state['chunk_size']),
+                                            self._state_path(upload_id), state['received'])
+                except (OSError, ValueError, LookupError, TypeError):
+                    raise LookupError('Unknown upload session')
+                self.sessions[upload_id] = session
+            return session
+
+    def discard(self, session):
+        with self.lock:
+            self.sessions.pop(session.upload_id, None)
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.state_dir, upload_id + '.json')
+
+def contained_path(root, path):
+    """Resolve path relative to root, raising ValueError when it ends up outside of root"""
+    root = os.path.realpath(root)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(os.path.join(root, '')):
+        raise ValueError('Path outside of the served directory: %s' % path)
+    return full_path
+
+def default_cache_dir():
+    """Per-user cache directory, shared with the bytecode cache of the bashrc launcher"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'webshare')
+
+def private_directory(path):
+    """Create path readable by its owner only, refusing one that another user controls"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise PermissionError('%s belongs to another user' % path)
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def default_upload_state_dir():
+    return os.path.join(default_cache_dir(), 'uploads')
+
+def cache_path(path):
+    """Return path, creating the private cache directory first when path lies in it"""
+    if os.path.dirname(path) == default_cache_dir():
+        private_directory(default_cache_dir())
+    return path
+
+# Listing type and Font Awesome icon by lowercase file extension
+FILE_TYPES = {}
+for _extensions, _file_type, _icon in [
+    (['.jpg', '.jpeg', '.png', '.gif', '.bmp'], "Image", 'fa-image'),
+    (['.mp3', '.wav', '.ogg'], "Audio", 'fa-music'),
+    (['.mp4', '.avi', '.mkv', '.mov'], "Video", 'fa-video'),
+    (['.pdf'], "PDF", 'fa-file-pdf'),
+    (['.doc', '.docx'], "Word", 'fa-file-word'),
+    (['.xls', '.xlsx'], "Excel", 'fa-file-excel'),
+    (['.zip', '.rar', '.7z', '.tar', '.gz'], "Archive", 'fa-file-archive'),
+    (['.txt', '.md'], "Text", 'fa-file-alt'),
+    (['.py', '.js', '.html', '.css', '.php', '.java', '.cpp'], "Code", 'fa-file-code'),
+]:
+    for _ext in _extensions:
+        FILE_TYPES[_ext] = (_file_type, _icon)
+
+def classify(name):
+    """Return (file type, icon) for a regular file name"""
+    ext = os.path.splitext(name)[1].lower()
+    if ext in FILE_TYPES:
+        return FILE_TYPES[ext]
+    return (ext[1:].upper() if ext else "File"), 'fa-file'
+
+# One row of a directory listing. size and mtime are None when unknown;
+# the size of a directory is the total of the files below it.
+ListingEntry = namedtuple('ListingEntry', 'name path is_dir is_link size mtime file_type icon')
+
+def dir_entry_order(dir_entry):
+    """Sort key of os.DirEntry objects, the 'name' order of the listing"""
+    return dir_entry.name.lower(), dir_entry.name
+
+def scan_directory(path, dir_size=None):
+    """List path in a single os.scandir pass, sorted by lowercase name"""
+    with os.scandir(path) as it:
+        dir_entries = sorted(it, key=dir_entry_order)
+    return list(listing_entries(dir_entries, dir_size))
+
+def listing_entries(dir_entries, dir_size=None):
+    """Yield the ListingEntry of each os.DirEntry, one at a time.
+
+    The file type comes from readdir, so each entry costs at most one stat
+    (shared by the symlink target check, size and mtime). dir_size(path, st)
+    computes the size of subdirectories; without it they are left unknown.
+    """
+    for dir_entry in dir_entries:
+        name = dir_entry.name
+        try:
+            st = dir_entry.stat()
+        except OSError:
+            st = None
+        is_link = dir_entry.is_symlink()
+        is_dir = st is not None and stat.S_ISDIR(st.st_mode)
+        size = None
+        if is_dir:
+            file_type, icon = "Directory", 'fa-folder'
+            if dir_size is not None:
+                size = dir_size(dir_entry.path, st)
+        else:
+            file_type, icon = classify(name)
+            if st is not None:
+                size = st.st_size
+        if is_link:
+            file_type, icon = "Link", 'fa-link'
+        yield ListingEntry(name, dir_entry.path, is_dir, is_link, size,
+                           st.st_mtime if st is not None else None, file_type, icon)
+
+# Extensions whose content is already compressed: stored as-is in ZIP downloads
+STORED_EXTENSIONS = set(ext for ext, (file_type, _) in FILE_TYPES.items()
+                        if file_type in ("Image", "Audio", "Video", "Archive"))
+STORED_EXTENSIONS -= set(['.bmp', '.wav'])
+STORED_EXTENSIONS |= set(['.docx', '.xlsx', '.jar', '.apk', '.epub', '.tgz', '.bz2', '.xz', '.zst',
+                          '.lz4', '.webp', '.avif', '.heic', '.webm', '.flac', '.m4a', '.aac'])
+
+# Size of the blocks deflated in parallel, and the window primed from the previous one
+DEFLATE_BLOCK_SIZE = 1024 * 1024
+DEFLATE_DICTIONARY_SIZE = 32 * 1024
+
+def deflate_block(data, level, dictionary=b''):
+    """Raw-deflate one block of a file so that blocks can simply be concatenated.
+
+    The block ends on a sync flush (byte-aligned, not final) and its window
+    is primed with the end of the previous block, as pigz does, so the
+    concatenation is a valid deflate stream once terminated by an empty
+    final block.
+    """
+    with timed('deflate_block'):
+        if dictionary:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+# Empty final block with fixed Huffman codes, terminating a deflate stream
+DEFLATE_END = b'\x03\x00'
+
+def flush_pending(pending, window=0):
+    """Run the queued (future or None, callback) pairs in order.
+
+    Each callback gets the result of its future. Items are taken while at
+    least window remain, and beyond that as long as the first one is ready.
+    """
+    while pending and (len(pending) >= window or pending[0][0] is None or pending[0][0].done()):
+        future, callback = pending.popleft()
+        callback(future.result() if future is not None else None)
+
+class ParallelDeflater(object):
+    """Raw-deflate a stream in DEFLATE_BLOCK_SIZE blocks on a thread pool.
+
+    Blocks are compressed concurrently (zlib releases the GIL) and passed
+    to write in submission order; at most window blocks are in flight, so
+    memory stays bounded whatever the stream length. Deflaters sharing a
+    pending queue write out in turn, so the next stream is compressed while
+    the previous one is still being written.
+    """
+
+    def __init__(self, write, pool, level=6, window=8, pending=None):
+        self.write_out = write
+        self.pool = pool
+        self.level = level
+        self.window = window
+        self.buffer = bytearray()
+        self.pending = deque() if pending is None else pending
+        self.dictionary = b''
+        self.crc = self.size = self.compressed_size = 0
+        self.done = None
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        if len(self.buffer) >= DEFLATE_BLOCK_SIZE:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        data = bytes(self.buffer)
+        del self.buffer[:]
+        self.pending.append((self.pool.submit(deflate_block, data, self.level, self.dictionary),
+                             self._write_block))
+        self.dictionary = data[-DEFLATE_DICTIONARY_SIZE:]
+        flush_pending(self.pending, self.window)
+
+    def _write_block(self, block):
+        self.write_out(block)
+        self.compressed_size += len(block)
+
+    def _end(self, _):
+        self._write_block(DEFLATE_END)
+        if self.done is not None:
+            self.done(self.crc, self.compressed_size, self.size)
+
+    def finish(self, done=None):
+        """Terminate the deflate stream and return (crc, compressed size, size).
+
+        With done, return None at once instead: done(crc, compressed size,
+        size) is called once the last block is written, by whichever later
+        call flushes the shared pending queue.
+        """
+        if self.buffer:
+            self._submit()
+        self.done = done
+        self.pending.append((None, self._end))
+        if done is None:
+            flush_pending(self.pending)
+            return self.crc, self.compressed_size, self.size
+
+class GzipStream(object):
+    """Write-only file object gzip-compressing into out with a ParallelDeflater"""
+
+    def __init__(self, out, pool, level=6, window=8):
+        self.out = out
+        # No file name or mtime, OS unknown
+        out.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+        self.deflater = ParallelDeflater(out.write, pool, level, window)
+
+    def write(self, data):
+        return self.deflater.write(data)
+
+    def close(self):
+        crc, _, size = self.deflater.finish()
+        self.out.write(struct.pack('<II', crc, size & 0xFFFFFFFF))
+
+class ZipStream(object):
+    """Write a ZIP archive to a non-seekable stream, deflating on a thread pool.
+
+    Entries are written in order, each followed by a data descriptor, with
+    ZIP64 records when sizes or offsets need them. Files are deflated by
+    ParallelDeflaters sharing one pending queue: as sizes only appear in the
+    data descriptors, the next files are compressed while earlier entries
+    are written, at most window blocks ahead. Level 0 stores every entry,
+    and already-compressed types are always stored.
+    """
+
+    def __init__(self, out, pool, level=6, window=8):
+        self.out = out
+        self.pool = pool
+        self.level = level
+        self.window = window
+        self.offset = 0
+        self.entries = []
+        self.pending = deque()
+
+    def _write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def write_file(self, f, arcname):
+        """Add the open regular file f as arcname"""
+        st = os.fstat(f.fileno())
+        ext = os.path.splitext(arcname)[1].lower()
+        method = 8 if self.level and ext not in STORED_EXTENSIONS else 0
+        # Decided up front: streamed entries cannot be rewritten. Leave
+        # room for deflate expanding incompressible data.
+        zip64 = st.st_size + (st.st_size >> 8) + 1024 >= 0xFFFFFFFF
+        version = 45 if zip64 else 20
+        name = arcname.replace(os.sep, '/').encode('utf-8')
+        flags = 0x08 | 0x800  # data descriptor, UTF-8 name
+        dostime, dosdate = dos_datetime(st.st_mtime)
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+        placeholder = 0xFFFFFFFF if zip64 else 0
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, method, dostime, dosdate,
+                             0, placeholder, placeholder, len(name), len(extra)) + name + extra
+        # The header offset is only known once the previous entries are written
+        entry = [name, version, flags, method, dostime, dosdate, st.st_mode, zip64, arcname, None]
+
+        def start(_):
+            entry[-1] = self.offset
+            self._write(header)
+
+        if method:
+            self.pending.append((None, start))
+            self._write_deflated(f, lambda *sizes: self._end_entry(entry, *sizes))
+        else:
+            flush_pending(self.pending)
+            start(None)
+            self._end_entry(entry, *self._write_stored(f))
+
+    def _end_entry(self, entry, crc, compressed_size, size):
+        """Write the data descriptor of entry and record it for the central directory"""
+        name, version, flags, method, dostime, dosdate, mode, zip64, arcname, header_offset = entry
+        if zip64:
+            self._write(struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size))
+        elif compressed_size >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+            raise ValueError('%s grew past 4 GB while being archived' % arcname)
+        else:
+            self._write(struct.pack('<IIII', 0x08074b50, crc, compressed_size, size))
+        self.entries.append((name, version, flags, method, dostime, dosdate, crc,
+                             compressed_size, size, mode, header_offset, zip64))
+
+    def _write_stored(self, f):
+        crc = size = 0
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                return crc, size, size
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            self._write(data)
+
+    def _write_deflated(self, f, done):
+        deflater = ParallelDeflater(self._write, self.pool, self.level, self.window, self.pending)
+        while True:
+            data = f.read(DEFLATE_BLOCK_SIZE)
+            if not data:
+                deflater.finish(done)
+                return
+            deflater.write(data)
+
+    def close(self):
+        """Write the central directory and end records"""
+        flush_pending(self.pending)
+        cd_offset = self.offset
+        for (name, version, flags, method, dostime, dosdate, crc,
+             compressed_size, size, mode, header_offset, zip64) in self.entries:
+            extra = b''
+            if zip64 or size >= 0xFFFFFFFF or compressed_size >= 0xFFFFFFFF:
+                extra += struct.pack('<QQ', size, compressed_size)
+                size = compressed_size = 0xFFFFFFFF
+            if header_offset >= 0xFFFFFFFF:
+                extra += struct.pack('<Q', header_offset)
+                header_offset = 0xFFFFFFFF
+            if extra:
+                extra = struct.pack('<HH', 1, len(extra)) + extra
+                version = 45
+            self._write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags,
+                                    method, dostime, dosdate, crc, compressed_size, size, len(name),
+                                    len(extra), 0, 0, 0, (mode & 0xFFFF) << 16, header_offset)
+                        + name + extra)
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+        if count >= 0xFFFF or cd_size >= 0xFFFFFFFF or cd_offset >= 0xFFFFFFFF:
+            zip64_end_offset = self.offset
+            self._write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                    count, count, cd_size, cd_offset))
+            self._write(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                min(cd_size, 0xFFFFFFFF), min(cd_offset, 0xFFFFFFFF), 0))
+
+# tar formats served by ?archive= and /download-selected?format=: (gzip, content type)
+ARCHIVE_FORMATS = {
+    'tar': (False, 'application/x-tar'),
+    'tar.gz': (True, 'application/gzip'),
+    'tgz': (True, 'application/gzip'),
+}
+
+def content_disposition(filename):
+    """Content-Disposition value downloading as filename, which may not be ASCII"""
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_').replace('"', '_')
+    return "attachment; filename=\"%s\"; filename*=UTF-8''%s" % (fallback, quote(filename, safe=''))
+
+def dos_datetime(timestamp):
+    """Return the (time, date) MS-DOS fields of a ZIP entry"""
+    t = time.localtime(timestamp)
+    year = min(max(t.tm_year, 1980), 2107)
+    if year != t.tm_year:
+        return 0, (year - 1980) << 9 | 1 << 5 | 1
+    return (t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+            (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday)
+
+_HEADER_PARAM_RE = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+def parse_header_params(value):
+    """Split a header like 'form-data; name="x"' into ('form-data', {'name': 'x'})"""
+    main, _, rest = value.partition(';')
+    params = {}
+    for key, val in _HEADER_PARAM_RE.findall(';' + rest):
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == '"':
+            val = re.sub(r'\\(.)', r'\1', val[1:-1])
+        params[key.lower()] = val
+    return main.strip().lower(), params
+
+class MultipartParser(object):
+    """Incremental multipart/form-data reader.
+
+    Iterating yields MultipartPart objects whose body is read from rfile in
+    chunk_size blocks, so memory stays bounded whatever the part size. Each
+    part must be consumed before moving to the next one; unread data is
+    skipped.
+    """
+
+    max_header_size = 16 * 1024
+
+    def __init__(self, rfile, boundary, length, chunk_size=CHUNK_SIZE):
+        self.rfile = rfile
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.delimiter = b'\r\n--' + boundary
+        # The first boundary is not preceded by CRLF: add one so it matches the delimiter
+        self.buffer = b'\r\n'
+
+    def _fill(self):
+        """Read the next block of the body into the buffer, False once it is exhausted"""
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not data:
+            raise ValueError('Upload interrupted: connection closed before the end of the request')
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def _read_until_delimiter(self):
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    yield self.buffer[:index]
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                return
+            if len(self.buffer) > keep:
+                yield self.buffer[:-keep]
+                self.buffer = self.buffer[-keep:]
+            if not self._fill():
+                raise ValueError('Malformed multipart body: closing boundary not found')
+
+    def __iter__(self):
+        # Discard the preamble
+        for _ in self._read_until_delimiter():
+            pass
+        while True:
+            while len(self.buffer) < 2:
+                if not self._fill():
+                    raise ValueError('Malformed multipart body: truncated boundary')
+            if self.buffer.startswith(b'--'):
+                # Closing boundary: discard the epilogue
+                while self._fill():
+                    self.buffer = b''
+                return
+            while True:
+                end = self.buffer.find(b'\r\n\r\n')
+                if end >= 0:
+                    break
+                if len(self.buffer) > self.max_header_size or not self._fill():
+                    raise ValueError('Malformed multipart body: invalid part headers')
+            raw_headers = self.buffer[2:end].decode('utf-8', 'replace')
+            self.buffer = self.buffer[end + 4:]
+            part = MultipartPart(raw_headers, self._read_until_delimiter())
+            yield part
+            for _ in part:
+                pass
+
+class MultipartPart(object):
+    """One part of a multipart body: iterate it to get the content in chunks"""
+
+    def __init__(self, raw_headers, body):
+        self.headers = {}
+        for line in raw_headers.split('\r\n'):
+            key, sep, value = line.partition(':')
+            if sep:
+                self.headers[key.strip().lower()] = value.strip()
+        _, params = parse_header_params(self.headers.get('content-disposition', ''))
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.body = body
+
+    def __iter__(self):
+        return self.body
+
+    def read(self):
+        return b''.join(self.body)
+
+# More ranges than this in one request is treated as abuse and ignored
+MAX_RANGES = 64
+
+def parse_range_header(value, size):
+    """Parse a 'bytes=' Range header for a resource of size bytes.
+
+    Returns None when the header is absent, malformed or not worth honouring
+    (the full content should be sent), [] when no range is satisfiable, or a
+    sorted list of inclusive (start, end) pairs with overlapping and adjacent
+    ranges coalesced.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, sep, last = item.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                # Suffix range: the last N bytes
+                length = int(last)
+                start, end = max(size - length, 0), size - 1
+                if length == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def file_etag(st):
+    """Strong entity tag of a file, from its inode, size and mtime"""
+    return '"%x-%x-%x"' % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def weak_etag(tag):
+    """Opaque part of an entity tag, for weak comparison"""
+    return tag[2:] if tag.startswith('W/') else tag
+
+def _script_stamp():
+    try:
+        st = os.stat(os.path.abspath(__file__))
+        return '%x-%x' % (st.st_size, st.st_mtime_ns)
+    except (NameError, OSError):
+        return ''
+
+# Changes whenever webshare itself is updated, so cached listings get re-rendered
+SCRIPT_STAMP = _script_stamp()
+
+def listing_etag(dir_stat, entries):
+    """Weak entity tag of a listing: changes with any listed name, type, size or mtime"""
+    import hashlib
+    digest = hashlib.sha1(SCRIPT_STAMP.encode())
+    digest.update(('%x-%x-%x' % (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns)).encode())
+    for entry in entries:
+        digest.update(repr((entry.name, entry.is_dir, entry.is_link, entry.size, entry.mtime)).encode('utf-8', 'replace'))
+    return 'W/"%s"' % digest.hexdigest()[:32]
+
+# Prefix of the URLs served by webshare itself rather than from the shared directory
+STATIC_PREFIX = '/__webshare__/static/'
+API_PREFIX = '/__webshare__/api/'
+METRICS_PATH = '/__webshare__/metrics'
+
+class StaticAsset(object):
+    """File built into the script, served from a URL carrying a hash of its content"""
+
+    def __init__(self, name, content_type, text):
+        self.name = name
+        self.data = text.encode('utf-8')
+        self.content_type = content_type
+        self._etag = self._url = None
+        self._gzipped = None
+
+    @property
+    def etag(self):
+        # Hashed on first use rather than at startup
+        if self._etag is None:
+            import hashlib
+            self._etag = '"%s"' % hashlib.sha1(self.data).hexdigest()[:16]
+        return self._etag
+
+    @property
+    def url(self):
+        if self._url is None:
+            base, ext = os.path.splitext(self.name)
+            self._url = '%s%s.%s%s' % (STATIC_PREFIX, base, self.etag.strip('"'), ext)
+        return self._url
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip_compress(self.data, 9)
+        return self._gzipped
+
+LISTING_CSS = StaticAsset('webshare.css', 'text/css; charset=utf-8', r'''
+        :root {
+            --bg-color: #1a1b1e;
+            --card-bg: #25262b;
+            --text-color: #c1c2c5;
+            --accent-color: #3b82f6;
+            --border-color: #2c2d31;
+            --hover-bg: #2c2d31;
+            --danger-color: #ef4444;
+            --success-color: #22c55e;
+            --folder-color: #3b82f6;
+            --file-color: #94a3b8;
         }
         
-        .search-container {
-            position: relative;
-            margin-bottom: 24px;
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
         }
         
-        .search-box {
-            width: 100%;
-            padding: 12px 20px;
-            font-size: 14px;
-            background: var(--card-bg);
-            border: 1px solid var(--border-color);
-            border-radius: 8px;
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
+            line-height: 1.5;
             color: var(--text-color);
-            transition: all 0.3s ease;
+            background: var(--bg-color);
+            font-size: 14px;
         }
         
-        .search-box:focus {
-            outline: none;
-            border-color: var(--accent-color);
-            box-shadow: 0 0 0 3px rgba(59, 130, 246, 0.3);
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 24px;
         }
         
-        .search-icon {
+        .header {
+            background: var(--card-bg);
+            padding: 24px;
+            border-radius: 12px;
+            margin-bottom: 24px;
+            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
+            display: flex;
+            align-items: center;
+            justify-content: space-between;
+            flex-wrap: wrap;
+            gap: 16px;
+        }
+        
+        .header h1 {
+            font-size: 24px;
+            font-weight: 600;
+            color: var(--text-color);
+            display: flex;
+            align-items: center;
+            gap: 12px;
+            margin: 0;
+        }
+        
+        .header h1 i {
+            color: var(--accent-color);
+        }
+
+        .server-info {
+            display: flex;
+            align-items: center;
+            gap: 24px;
+            color: #6b7280;
+            font-size: 14px;
+        }
+
+        .server-info span {
+            display: flex;
+            align-items: center;
+            gap: 8px;
+        }
+
+        .server-info i {
+            font-size: 14px;
+            opacity: 0.8;
+        }
+
+        .server-info .hostname {
+            color: var(--accent-color);
+            font-weight: 500;
+        }
+
+        .server-info .path {
+            color: var(--success-color);
+            font-weight: 500;
+            word-break: break-all;
+        }
+        
+        .upload-zone {
+            background: var(--card-bg);
+            border: 2px dashed var(--border-color);
+            border-radius: 12px;
+            padding: 32px;
+            text-align: center;
+            margin-bottom: 24px;
+            transition: all 0.3s ease;
+            position: relative;
+        }
+        
+        .upload-zone:hover, .upload-zone.dragover {
+            border-color: var(--accent-color);
+            background: rgba(59, 130, 246, 0.05);
+        }
+        
+        .upload-zone i {
+            font-size: 48px;
+            color: var(--text-color);
+            margin-bottom: 16px;
+            opacity: 0.8;
+        }
+        
+        .upload-zone h3 {
+            font-size: 18px;
+            margin-bottom: 8px;
+            color: var(--text-color);
+        }
+        
+        .upload-zone p {
+            color: #6b7280;
+            margin-bottom: 24px;
+        }
+
+        .upload-zone form {
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            gap: 16px;
+        }
+
+        .upload-zone input[type="file"] {
+            display: none;
+        }
+
+        .upload-btn, .file-input-label {
+            display: inline-flex;
+            align-items: center;
+            justify-content: center;
+            gap: 8px;
+            padding: 0 24px;
+            font-size: 14px;
+            font-weight: 500;
+            border-radius: 8px;
+            cursor: pointer;
+            transition: all 0.3s ease;
+            height: 42px;
+            min-width: 140px;
+        }
+
+        .upload-btn {
+            color: #fff;
+            background: linear-gradient(45deg, var(--accent-color), #2563eb);
+            border: none;
+            box-shadow: 0 4px 6px -1px rgba(59, 130, 246, 0.2);
+        }
+        
+        .upload-btn:hover {
+            transform: translateY(-2px);
+            box-shadow: 0 6px 8px -1px rgba(59, 130, 246, 0.3);
+            background: linear-gradient(45deg, #2563eb, #1d4ed8);
+        }
+        
+        .upload-btn:active {
+            transform: translateY(0);
+            box-shadow: 0 2px 4px -1px rgba(59, 130, 246, 0.2);
+        }
+        
+        .upload-btn i {
+            font-size: 16px;
+            color: #fff;
+            margin-bottom: 4px;
+        }
+
+        .file-input-label {
+            color: var(--text-color);
+            background: var(--hover-bg);
+            border: 1px solid var(--border-color);
+        }
+
+        .file-input-label:hover {
+            background: var(--card-bg);
+            border-color: var(--accent-color);
+            transform: translateY(-2px);
+        }
+
+        .file-input-label i {
+            font-size: 16px;
+            color: var(--accent-color);
+            margin-bottom: 4px;
+        }
+        
+        .search-container {
+            position: relative;
+            margin-bottom: 24px;
+        }
+        
+        .search-box {
+            width: 100%;
+            padding: 12px 20px;
+            font-size: 14px;
+            background: var(--card-bg);
+            border: 1px solid var(--border-color);
+            border-radius: 8px;
+            color: var(--text-color);
+            transition: all 0.3s ease;
+        }
+        
+        .search-box:focus {
+            outline: none;
+            border-color: var(--accent-color);
+            box-shadow: 0 0 0 3px rgba(59, 130, 246, 0.3);
+        }
+        
+        .search-icon {
             position: absolute;
             right: 12px;
             top: 50%;
@@ -660,6 +2145,15 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
         .file .file-icon {
             color: var(--file-color);
         }
+
+        .checksum {
+            margin: 4px 0 0 28px;
+            font-family: monospace;
+            font-size: 12px;
+            color: #6b7280;
+            word-break: break-all;
+            cursor: copy;
+        }
         
         a {
             color: var(--text-color);
@@ -683,6 +2177,7 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
             border: none;
             border-radius: 8px;
             cursor: pointer;
+            text-decoration: none;
             transition: all 0.3s ease;
         }
         
@@ -721,6 +2216,41 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
         .hidden {
             display: none;
         }
+
+        #search-results {
+            background: var(--card-bg);
+            border-radius: 12px;
+            padding: 16px 24px;
+            margin-bottom: 24px;
+            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
+        }
+
+        #search-results.hidden {
+            display: none;
+        }
+
+        #search-results .search-summary {
+            display: flex;
+            justify-content: space-between;
+            color: #6b7280;
+            margin-bottom: 8px;
+        }
+
+        #search-results .search-summary a {
+            cursor: pointer;
+        }
+
+        #search-results li {
+            list-style: none;
+            padding: 4px 0;
+            word-break: break-all;
+        }
+
+        #listing-more {
+            padding: 16px;
+            text-align: center;
+            color: #6b7280;
+        }
         
         @media (max-width: 768px) {
             .container {
@@ -747,8 +2277,9 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
                 width: auto;
             }
         }
-    </style>''')
-        r.append(r'''    <script>
+''')
+
+LISTING_JS = StaticAsset('webshare.js', 'text/javascript; charset=utf-8', r'''
         function handleDragOver(evt) {
             evt.preventDefault();
             evt.target.classList.add("dragover");
@@ -761,24 +2292,130 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
         function handleDrop(evt) {
             evt.preventDefault();
             evt.target.classList.remove("dragover");
-            var files = evt.dataTransfer.files;
-            var formData = new FormData();
-            
-            for (var i = 0; i < files.length; i++) {
-                formData.append('file[]', files[i], files[i].webkitRelativePath || files[i].name);
+            uploadFiles(evt.dataTransfer.files);
+        }
+
+        // Files this large go through resumable chunked uploads
+        const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+        const PARALLEL_CHUNKS = 4;
+        const CHUNK_RETRIES = 5;
+
+        function submitUpload(evt) {
+            const files = document.getElementById('fileInput').files;
+            if (Array.from(files).some(file => file.size >= CHUNKED_UPLOAD_THRESHOLD)) {
+                evt.preventDefault();
+                uploadFiles(files);
+                return false;
             }
-            
-            fetch('/upload', {
-                method: 'POST',
-                body: formData
+            return true;
+        }
+
+        function uploadFiles(fileList) {
+            const files = Array.from(fileList);
+            const large = files.filter(file => file.size >= CHUNKED_UPLOAD_THRESHOLD);
+            const status = document.querySelector('.upload-zone p');
+            let chain = Promise.resolve();
+            large.forEach(file => {
+                const path = file.webkitRelativePath || file.name;
+                chain = chain.then(() => uploadInChunks(file, path, fraction => {
+                    status.textContent = `Uploading ${path}: ${(fraction * 100).toFixed(1)}%`;
+                }));
+            });
+            chain.then(() => {
+                // Small files in one multipart request, which also reports the chunked ones
+                const formData = new FormData();
+                files.forEach(file => {
+                    const path = file.webkitRelativePath || file.name;
+                    if (file.size >= CHUNKED_UPLOAD_THRESHOLD) {
+                        formData.append('uploaded[]', path);
+                    } else {
+                        formData.append('file[]', file, path);
+                    }
+                });
+                return fetch('/upload', {
+                    method: 'POST',
+                    body: formData
+                });
             }).then(response => response.text())
               .then(html => {
                   document.body.innerHTML = html;
+              })
+              .catch(error => {
+                  status.textContent = `Upload failed: ${error.message}. Upload the same files again to resume.`;
               });
         }
 
+        function apiJson(response) {
+            return response.json().then(data => response.ok ? data : Promise.reject(new Error(data.error || response.statusText)));
+        }
+
+        function uploadInChunks(file, path, onProgress) {
+            return fetch('/__webshare__/api/uploads', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({
+                    path: path,
+                    size: file.size,
+                    fingerprint: `${file.name}:${file.size}:${file.lastModified}`
+                })
+            }).then(apiJson).then(session => {
+                // Resuming: skip what the server already has
+                const received = new Set(session.received);
+                const pending = [];
+                for (let index = 0; index < session.chunks; index++) {
+                    if (!received.has(index)) {
+                        pending.push(index);
+                    }
+                }
+                let done = received.size;
+                onProgress(session.chunks ? done / session.chunks : 1);
+                const worker = () => {
+                    const index = pending.shift();
+                    if (index === undefined) {
+                        return Promise.resolve();
+                    }
+                    const start = index * session.chunk_size;
+                    const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+                    return putChunk(session.id, start, chunk, 0).then(() => {
+                        done++;
+                        onProgress(done / session.chunks);
+                        return worker();
+                    });
+                };
+                const workers = [];
+                for (let i = 0; i < PARALLEL_CHUNKS; i++) {
+                    workers.push(worker());
+                }
+                return Promise.all(workers).then(() => fetch(`/__webshare__/api/uploads/${session.id}/commit`, {
+                    method: 'POST'
+                })).then(apiJson);
+            });
+        }
+
+        function putChunk(id, offset, chunk, attempt) {
+            return fetch(`/__webshare__/api/uploads/${id}?offset=${offset}`, {
+                method: 'PUT',
+                body: chunk
+            }).then(apiJson).catch(error => {
+                if (attempt >= CHUNK_RETRIES) {
+                    throw error;
+                }
+                return new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt))
+                    .then(() => putChunk(id, offset, chunk, attempt + 1));
+            });
+        }
+
         function searchFiles() {
             const searchTerm = document.getElementById('searchBox').value.toLowerCase();
+            if (isPaginated()) {
+                // Only part of the directory is loaded: filter on the server
+                clearTimeout(listing.filterTimer);
+                listing.filterTimer = setTimeout(() => {
+                    listing.filter = searchTerm;
+                    loadMore(true);
+                }, 250);
+                return;
+            }
             const rows = document.querySelectorAll('.files-table tr:not(:first-child)');
             let visibleCount = 0;
 
@@ -819,108 +2456,1867 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
             return totalSize;
         }
 
-        function formatSize(bytes) {
-            const units = ['B', 'KB', 'MB', 'GB', 'TB'];
-            let size = bytes;
-            let unitIndex = 0;
-            while (size >= 1024 && unitIndex < units.length - 1) {
-                size /= 1024;
-                unitIndex++;
-            }
-            return unitIndex === 0 ? size + ' ' + units[unitIndex] : size.toFixed(1) + ' ' + units[unitIndex];
-        }
+        function formatSize(bytes) {
+            const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+            let size = bytes;
+            let unitIndex = 0;
+            while (size >= 1024 && unitIndex < units.length - 1) {
+                size /= 1024;
+                unitIndex++;
+            }
+            return unitIndex === 0 ? size + ' ' + units[unitIndex] : size.toFixed(1) + ' ' + units[unitIndex];
+        }
+
+        function downloadSelected(format) {
+            const checkboxes = document.getElementsByName('file-select');
+            const selectedFiles = [];
+            
+            for (let checkbox of checkboxes) {
+                if (checkbox.checked) {
+                    selectedFiles.push(checkbox.value);
+                }
+            }
+
+            if (selectedFiles.length === 0) {
+                alert('Please select at least one item to download');
+                return;
+            }
+
+            format = format || 'zip';
+            fetch('/download-selected?format=' + format, {
+                method: 'POST',
+                body: JSON.stringify(selectedFiles)
+            }).then(response => response.blob())
+              .then(blob => {
+                  const url = window.URL.createObjectURL(blob);
+                  const a = document.createElement('a');
+                  a.href = url;
+                  a.download = 'selected_files.' + format;
+                  document.body.appendChild(a);
+                  a.click();
+                  window.URL.revokeObjectURL(url);
+              });
+        }
+
+        function sortTable(columnIndex) {
+            const table = document.querySelector('.files-table');
+            const header = table.querySelector(`th:nth-child(${columnIndex + 1})`);
+            const isAsc = !header.classList.contains('sorted-asc');
+            
+            // Remove sorting classes from all headers
+            table.querySelectorAll('th').forEach(th => {
+                th.classList.remove('sorted-asc', 'sorted-desc');
+                const icon = th.querySelector('i');
+                if (icon) {
+                    icon.className = 'fas fa-sort';
+                }
+            });
+            
+            // Add sorting class to clicked header
+            header.classList.add(isAsc ? 'sorted-asc' : 'sorted-desc');
+            const icon = header.querySelector('i');
+            if (icon) {
+                icon.className = `fas fa-sort-${isAsc ? 'up' : 'down'}`;
+            }
+
+            if (isPaginated()) {
+                listing.sort = ['name', 'name', 'type', 'size', 'mtime'][columnIndex];
+                listing.order = isAsc ? 'asc' : 'desc';
+                loadMore(true);
+                return;
+            }
+            
+            const tbody = table.querySelector('tbody') || table;
+            const rows = Array.from(tbody.querySelectorAll('tr:not(:first-child)'));
+            
+            const sortedRows = rows.sort((a, b) => {
+                let aValue = a.querySelector(`td:nth-child(${columnIndex + 1})`).textContent.trim();
+                let bValue = b.querySelector(`td:nth-child(${columnIndex + 1})`).textContent.trim();
+                
+                // Handle name column - remove icon from comparison
+                if (columnIndex === 1) {
+                    aValue = aValue.replace(/^[\u{1F300}-\u{1F9FF}]|^[\u2600-\u26FF]|\s+$/gu, '').trim();
+                    bValue = bValue.replace(/^[\u{1F300}-\u{1F9FF}]|^[\u2600-\u26FF]|\s+$/gu, '').trim();
+                }
+                
+                // Handle size sorting
+                if (columnIndex === 3) {
+                    aValue = parseInt(a.querySelector('.size').getAttribute('data-size'));
+                    bValue = parseInt(b.querySelector('.size').getAttribute('data-size'));
+                    return isAsc ? aValue - bValue : bValue - aValue;
+                }
+                
+                // Handle date sorting
+                if (columnIndex === 4) {
+                    aValue = new Date(aValue).getTime();
+                    bValue = new Date(bValue).getTime();
+                    return isAsc ? aValue - bValue : bValue - aValue;
+                }
+                
+                // Default string comparison
+                return isAsc ? 
+                    aValue.localeCompare(bValue, undefined, {numeric: true, sensitivity: 'base'}) :
+                    bValue.localeCompare(aValue, undefined, {numeric: true, sensitivity: 'base'});
+            });
+            
+            // Remove existing rows
+            rows.forEach(row => row.remove());
+            
+            // Add sorted rows
+            sortedRows.forEach(row => tbody.appendChild(row));
+        }
+
+        // Huge directories come in pages from the listing API: #listing-more
+        // carries the cursor of the next page, fetched when scrolled into view
+        const listing = {sort: 'name', order: 'asc', filter: '', cursor: null, loading: false, generation: 0};
+
+        function isPaginated() {
+            return document.getElementById('listing-more') !== null;
+        }
+
+        function initListing() {
+            const more = document.getElementById('listing-more');
+            if (!more) {
+                return;
+            }
+            listing.cursor = more.getAttribute('data-next-cursor');
+            new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMore(false);
+                }
+            }, {rootMargin: '800px'}).observe(more);
+        }
+
+        function moreVisible() {
+            const more = document.getElementById('listing-more');
+            return more.getBoundingClientRect().top < window.innerHeight + 800;
+        }
+
+        function loadMore(reset) {
+            if (!reset && (listing.loading || !listing.cursor)) {
+                return;
+            }
+            // A new sort or filter makes pending pages obsolete
+            const generation = reset ? ++listing.generation : listing.generation;
+            const params = new URLSearchParams({
+                path: window.location.pathname,
+                sort: listing.sort,
+                order: listing.order,
+                filter: listing.filter
+            });
+            if (!reset) {
+                params.set('cursor', listing.cursor);
+            }
+            listing.loading = true;
+            fetch('/__webshare__/api/list?' + params)
+                .then(response => response.json())
+                .then(page => {
+                    if (generation !== listing.generation) {
+                        return;
+                    }
+                    const table = document.querySelector('.files-table');
+                    const tbody = table.querySelector('tbody') || table;
+                    if (reset) {
+                        tbody.querySelectorAll('tr:not(:first-child)').forEach(row => row.remove());
+                    }
+                    page.entries.forEach(entry => tbody.appendChild(renderRow(entry)));
+                    listing.cursor = page.next_cursor;
+                    listing.loading = false;
+                    document.getElementById('listing-more').style.display = listing.cursor ? '' : 'none';
+                    updateSelectedCount();
+                    if (listing.cursor && moreVisible()) {
+                        loadMore(false);
+                    }
+                })
+                .catch(() => {
+                    listing.loading = false;
+                });
+        }
+
+        function renderRow(entry) {
+            const kind = entry.is_dir ? 'folder' : 'file';
+            const row = document.createElement('tr');
+            row.className = kind + '-row';
+
+            const cell = (className, text) => {
+                const td = document.createElement('td');
+                td.className = className;
+                td.textContent = text;
+                return td;
+            };
+
+            const checkCell = cell('checkbox-column', '');
+            const checkbox = document.createElement('input');
+            checkbox.type = 'checkbox';
+            checkbox.name = 'file-select';
+            checkbox.value = entry.path;
+            checkbox.onclick = updateSelectedCount;
+            checkCell.appendChild(checkbox);
+
+            const nameCell = cell('name-column', '');
+            const link = document.createElement('a');
+            link.href = entry.href;
+            link.className = kind;
+            const icon = document.createElement('i');
+            icon.className = 'fas ' + entry.icon + ' file-icon';
+            link.append(icon, entry.name);
+            nameCell.appendChild(link);
+
+            const sizeCell = cell('size', entry.size === null ? '???' : formatSize(entry.size));
+            sizeCell.setAttribute('data-size', entry.size || 0);
+
+            row.append(checkCell, nameCell, cell('type', entry.type), sizeCell,
+                       cell('date', entry.modified === null ? '???' : entry.modified));
+            addChecksum(row);
+            return row;
+        }
+
+        // SHA-256 of the files of this folder by name, shown under the names on request
+        const checksums = new Map();
+
+        function showChecksums() {
+            const button = document.getElementById('checksums-button');
+            button.disabled = true;
+            fetch('/__webshare__/api/checksums?' + new URLSearchParams({path: window.location.pathname, recursive: '0'}))
+                .then(apiJson)
+                .then(data => {
+                    data.files.forEach(file => checksums.set(file.path, file.checksum));
+                    document.querySelectorAll('.files-table tr.file-row').forEach(addChecksum);
+                })
+                .catch(error => alert('Checksums failed: ' + error.message))
+                .then(() => {
+                    button.disabled = false;
+                });
+        }
+
+        function addChecksum(row) {
+            const link = row.querySelector('.name-column a');
+            const checksum = link && checksums.get(link.textContent);
+            if (!checksum || row.querySelector('.checksum')) {
+                return;
+            }
+            const line = document.createElement('div');
+            line.className = 'checksum';
+            line.textContent = checksum;
+            line.title = 'SHA-256, click to copy';
+            line.onclick = () => navigator.clipboard && navigator.clipboard.writeText(checksum);
+            link.parentNode.appendChild(line);
+        }
+
+        function searchEverywhere() {
+            const query = document.getElementById('searchBox').value.trim();
+            const panel = document.getElementById('search-results');
+            if (!query) {
+                panel.classList.add('hidden');
+                return;
+            }
+            fetch('/__webshare__/api/search?' + new URLSearchParams({q: query}))
+                .then(response => response.json())
+                .then(data => {
+                    panel.textContent = '';
+                    const summary = document.createElement('div');
+                    summary.className = 'search-summary';
+                    const text = document.createElement('span');
+                    if (data.error) {
+                        text.textContent = data.error;
+                    } else {
+                        text.textContent = `${data.results.length}${data.truncated ? '+' : ''} result(s) for "${data.query}" in all folders` +
+                            ` (${data.took_ms} ms${data.indexing ? ', indexing still in progress' : ''})`;
+                    }
+                    const close = document.createElement('a');
+                    close.innerHTML = '<i class="fas fa-times"></i>';
+                    close.onclick = () => panel.classList.add('hidden');
+                    summary.append(text, close);
+                    const list = document.createElement('ul');
+                    (data.results || []).forEach(result => {
+                        const item = document.createElement('li');
+                        const link = document.createElement('a');
+                        link.href = result.href;
+                        const icon = document.createElement('i');
+                        icon.className = 'fas ' + (result.is_dir ? 'fa-folder' : 'fa-file') + ' file-icon';
+                        link.append(icon, result.path);
+                        item.appendChild(link);
+                        list.appendChild(item);
+                    });
+                    panel.append(summary, list);
+                    panel.classList.remove('hidden');
+                });
+        }
+
+        document.addEventListener('DOMContentLoaded', initListing);
+''')
+
+STATIC_ASSETS = (LISTING_CSS, LISTING_JS)
+
+# HTML bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+# Rows rendered with the HTML page; the rest is fetched from the listing API
+LISTING_PAGE_SIZE = 500
+# Listings of directories with more entries, or with subdirectories whose size
+# is not in the size index yet, are streamed, without validator; a streamed
+# listing is flushed every LISTING_STREAM_BATCH rows, or sooner when rows come
+# slowly (seconds)
+LISTING_STREAM_MIN_ENTRIES = LISTING_PAGE_SIZE
+LISTING_STREAM_BATCH = 50
+LISTING_STREAM_INTERVAL = 0.05
+MAX_LISTING_PAGE_SIZE = 5000
+
+# Sort keys of the listing API. The name ends every key so the order is total.
+LISTING_SORT_KEYS = {
+    'name': lambda e: (e.name.lower(), e.name),
+    'type': lambda e: (e.file_type.lower(), e.name.lower(), e.name),
+    'size': lambda e: (-1 if e.size is None else e.size, e.name.lower(), e.name),
+    'mtime': lambda e: (0 if e.mtime is None else e.mtime, e.name.lower(), e.name),
+}
+
+class DirectorySnapshot(object):
+    """One scan of a directory, with sorted views paged through by cursor.
+
+    A cursor is the sort key of the last entry of the previous page, so
+    pages stay consistent even if the snapshot is rebuilt in between.
+    """
+
+    def __init__(self, dir_stat, entries):
+        self.dir_stat = dir_stat
+        self.entries = entries
+        self.created = time.time()
+        self.etag = listing_etag(dir_stat, entries)
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def order(self, sort):
+        """Return (keys, entries) sorted ascending by the given sort key"""
+        with self.lock:
+            if sort not in self.orders:
+                key = LISTING_SORT_KEYS[sort]
+                decorated = sorted((key(entry), index) for index, entry in enumerate(self.entries))
+                self.orders[sort] = ([k for k, _ in decorated], [self.entries[i] for _, i in decorated])
+            return self.orders[sort]
+
+    def page(self, sort='name', descending=False, cursor=None, name_filter='', limit=LISTING_PAGE_SIZE):
+        """Return (entries, next cursor or None) for the page following cursor"""
+        keys, entries = self.order(sort)
+        if descending:
+            end = len(keys) if cursor is None else bisect.bisect_left(keys, cursor)
+            candidates = range(end - 1, -1, -1)
+        else:
+            start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+            candidates = range(start, len(keys))
+        name_filter = name_filter.lower()
+        selected = []
+        for index in candidates:
+            if name_filter and name_filter not in entries[index].name.lower():
+                continue
+            if len(selected) == limit:
+                return [entries[i] for i in selected], keys[selected[-1]]
+            selected.append(index)
+        return [entries[i] for i in selected], None
+
+    def count(self, name_filter=''):
+        name_filter = name_filter.lower()
+        if not name_filter:
+            return len(self.entries)
+        return sum(1 for entry in self.entries if name_filter in entry.name.lower())
+
+class SnapshotCache(object):
+    """Recent DirectorySnapshots, reused while the directory mtime is unchanged"""
+
+    def __init__(self, max_entries=16, max_age=10):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.snapshots = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, scan):
+        """Return a snapshot of path, calling scan(path) to build one if needed"""
+        dir_stat, snapshot = self.lookup(path)
+        if snapshot is None:
+            snapshot = self.store(path, dir_stat, scan(path))
+        return snapshot
+
+    def lookup(self, path):
+        """Return (stat of path, its snapshot if still valid, else None)"""
+        dir_stat = os.stat(path)
+        with self.lock:
+            snapshot = self.snapshots.get(path)
+            if (snapshot is not None and snapshot.dir_stat.st_mtime_ns == dir_stat.st_mtime_ns
+                    and snapshot.dir_stat.st_ino == dir_stat.st_ino
+                    and time.time() - snapshot.created < self.max_age):
+                self.snapshots.move_to_end(path)
+                METRICS.count_cache('listing', 'hit')
+                return dir_stat, snapshot
+        METRICS.count_cache('listing', 'miss')
+        return dir_stat, None
+
+    def store(self, path, dir_stat, entries):
+        """Cache and return the snapshot of a scan of path started at dir_stat"""
+        snapshot = DirectorySnapshot(dir_stat, entries)
+        with self.lock:
+            self.snapshots[path] = snapshot
+            self.snapshots.move_to_end(path)
+            while len(self.snapshots) > self.max_entries:
+                self.snapshots.popitem(last=False)
+        return snapshot
+
+def encode_cursor(key):
+    import json
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raising ValueError on garbage"""
+    import json
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+class FileUploadHandler(SimpleHTTPRequestHandler):
+    # DirSizeIndex shared by all requests, set up by main()
+    size_index = None
+    # Directory scans shared by the HTML listing and the listing API
+    snapshots = SnapshotCache()
+    # FilenameIndex over the served directory, set up by main()
+    filename_index = None
+    # UploadSessions for chunked uploads, set up by main()
+    uploads = None
+    # Deflate level of ZIP and tar.gz downloads (0 stores everything) and compression threads
+    zip_level = 6
+    zip_threads = os.cpu_count() or 1
+    zip_pool = None
+    zip_pool_lock = threading.Lock()
+    # ChecksumCache shared by all requests, set up by main(), and the hashing threads
+    checksum_cache = None
+    hash_threads = os.cpu_count() or 1
+    hash_pool = None
+    hash_pool_lock = threading.Lock()
+    # AccessLog receiving one JSON record per request, set up by main() when enabled
+    access_log = None
+    # RequestProfiler for --profile, set up by main()
+    profiler = None
+    # PreforkWorker when this process is one of several serving the port (--processes)
+    worker = None
+    # Secret that PUT requests on the limits API must bear, set up by main()
+    control_token = None
+    # Persistent connections: every response is framed by Content-Length or chunks
+    protocol_version = 'HTTP/1.1'
+    # Idle time allowed before a request starts, and requests served per connection
+    keepalive_timeout = 15
+    keepalive_requests = 100
+    # Idle connections check this often whether others wait for their worker,
+    # and give it up once idle for keepalive_busy_grace seconds
+    keepalive_poll_interval = 0.1
+    keepalive_busy_grace = 0.5
+    # Socket timeout while a request is being read or answered
+    timeout = 300
+    # Headers and body go out in separate writes: with Nagle's algorithm the
+    # body of a small response would wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+    # BandwidthLimiter shaping every connection, configured by main() and the limits API
+    limiter = BandwidthLimiter()
+    # Send file bodies with os.sendfile (zero-copy) where the platform allows it
+    use_sendfile = hasattr(os, 'sendfile')
+
+    def setup(self):
+        SimpleHTTPRequestHandler.setup(self)
+        # Count bytes in both directions for the metrics endpoint
+        self.rfile.close()
+        client = self.client_address[0]
+        self.rfile = io.BufferedReader(CountingReader(self.connection, self.limiter.throttle(client, 'up')))
+        self.wfile = CountingWriter(self.connection, self.limiter.throttle(client, 'down'))
+        self.requests_served = 0
+
+    def handle(self):
+        METRICS.adjust('connections', 1)
+        try:
+            SimpleHTTPRequestHandler.handle(self)
+        finally:
+            METRICS.adjust('connections', -1)
+
+    def handle_one_request(self):
+        """Serve one request, recording it in METRICS under self.route and in the access log"""
+        self.route = 'other'
+        self.status_code = None
+        self.request_start = self.first_byte = self.profile = None
+        if not self._wait_for_request():
+            self.close_connection = True
+            return
+        self.connection.settimeout(self.timeout)
+        sent, received = self.wfile.count, self.rfile.raw.count
+        try:
+            SimpleHTTPRequestHandler.handle_one_request(self)
+        finally:
+            if self.profile is not None:
+                self.profiler.end(self.profile, self.route)
+            if self.request_start is not None:
+                self.requests_served += 1
+                duration = time.perf_counter() - self.request_start
+                sent = self.wfile.count - sent
+                received = self.rfile.raw.count - received
+                METRICS.observe_request(self.route, self.command, self.status_code, duration, sent, received)
+                if self.access_log is not None:
+                    self.access_log.write({
+                        'time': self.request_time,
+                        'client': self.client_address[0],
+                        'method': self.command,
+                        'path': self.path,
+                        'route': self.route,
+                        'status': self.status_code,
+                        'bytes': sent,
+                        'bytes_received': received,
+                        'duration_ms': round(duration * 1000, 3),
+                        'ttfb_ms': None if self.first_byte is None
+                                   else round((self.first_byte - self.request_start) * 1000, 3),
+                    })
+                if self.worker is not None:
+                    self.worker.request_done()
+
+    def _wait_for_request(self):
+        """Wait up to keepalive_timeout for a request to start, False if none came.
+
+        A connection idle for keepalive_busy_grace gives its worker up as
+        soon as other connections wait for one.
+        """
+        start = time.monotonic()
+        self.connection.settimeout(0)
+        try:
+            # Pipelined requests are already buffered
+            if self.rfile.peek(1):
+                return True
+            while True:
+                waited = time.monotonic() - start
+                if waited >= self.keepalive_timeout:
+                    return False
+                if waited >= self.keepalive_busy_grace and self.server_busy():
+                    return False
+                timeout = min(self.keepalive_timeout - waited, self.keepalive_poll_interval)
+                if select.select([self.connection], [], [], timeout)[0]:
+                    # Readable with nothing to read: the client closed the connection
+                    return bool(self.rfile.peek(1))
+        except OSError:  # connection reset
+            return False
+
+    def parse_request(self):
+        # The request line has been read: the request is now in flight
+        self.request_start = time.perf_counter()
+        self.request_time = time.time()
+        METRICS.adjust('in_flight', 1)
+        if self.profiler is not None:
+            self.profile = self.profiler.begin()
+        if not SimpleHTTPRequestHandler.parse_request(self):
+            return False
+        if self.requests_served + 1 >= self.keepalive_requests:
+            self.close_connection = True
+        return True
+
+    def handle_expect_100(self):
+        # Sent directly so that it neither counts as the response's first byte
+        # nor gets the Connection header of the final response
+        self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        return True
+
+    def flush_headers(self):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()
+        SimpleHTTPRequestHandler.flush_headers(self)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        self.connection_header_sent = False
+        if code >= 400 and self.command in ('POST', 'PUT'):
+            # The request body may not have been read entirely
+            self.close_connection = True
+        SimpleHTTPRequestHandler.send_response(self, code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.connection_header_sent = True
+        SimpleHTTPRequestHandler.send_header(self, keyword, value)
+
+    def end_headers(self):
+        """Announce whether the connection stays open, then end the headers"""
+        if not self.close_connection and self.server_busy():
+            # Free this worker for connections waiting in the queue
+            self.close_connection = True
+        if not getattr(self, 'connection_header_sent', True):
+            version = getattr(self, 'request_version', None)
+            if self.close_connection and version == 'HTTP/1.1':
+                self.send_header('Connection', 'close')
+            elif not self.close_connection and version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def server_busy(self):
+        if self.worker is not None and self.worker.draining:
+            return True
+        busy = getattr(self.server, 'busy', None)
+        return busy is not None and busy()
+
+    def do_GET(self):
+        """Serve a GET request, honouring Range for regular files"""
+        self.ranges = None
+        f = self.send_head()
+        if f:
+            try:
+                if self.ranges:
+                    self.copy_ranges(f, self.wfile)
+                else:
+                    self.copyfile(f, self.wfile)
+            finally:
+                f.close()
+
+    def send_head(self):
+        """Send the headers of a GET/HEAD response and return the file to copy.
+
+        Directories keep the stock behaviour (redirect, index.html, listing).
+        Regular files advertise Accept-Ranges and answer a satisfiable Range
+        with 206 Partial Content, as multipart/byteranges for several ranges.
+        """
+        self.ranges = None
+        if self.path.startswith(STATIC_PREFIX):
+            self.route = 'static'
+            path = self.path.split('?', 1)[0]
+            return self.send_static(next((asset for asset in STATIC_ASSETS if asset.url == path), None))
+        if self.path.startswith(API_PREFIX):
+            self.route = 'api'
+            self.handle_api()
+            return None
+        if self.path.split('?', 1)[0] == METRICS_PATH:
+            self.route = 'metrics'
+            self.send_metrics()
+            return None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            params = parse_qs(self.path.partition('?')[2])
+            if 'archive' in params:
+                self.route = 'tar'
+                self.send_directory_archive(path, params)
+                return None
+            self.route = 'listing'
+            return SimpleHTTPRequestHandler.send_head(self)
+        self.route = 'file'
+        if path.endswith('/'):
+            self.send_error(404, "File not found")
+            return None
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+            etag = file_etag(fs)
+            if self._not_modified(etag, fs.st_mtime):
+                self.send_not_modified(etag, fs.st_mtime)
+                f.close()
+                return None
+
+            ctype = self.guess_type(path)
+            size = fs.st_size
+            ranges = None
+            if self.command in ('GET', 'HEAD') and self._if_range_matches(etag, fs):
+                ranges = parse_range_header(self.headers.get('Range'), size)
+            if ranges == []:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                f.close()
+                return None
+
+            if not ranges:
+                self.send_response(200)
+                self.send_header("Content-type", ctype)
+                self.send_header("Content-Length", str(size))
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_response(206)
+                self.send_header("Content-type", ctype)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+                self.send_header("Content-Length", str(end - start + 1))
+            else:
+                self.range_boundary = os.urandom(12).hex()
+                self.range_parts = [
+                    ('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                     % (self.range_boundary, ctype, start, end, size)).encode('latin-1')
+                    for start, end in ranges
+                ]
+                length = sum(len(header) + end - start + 1
+                             for header, (start, end) in zip(self.range_parts, ranges))
+                length += len(self._range_trailer())
+                self.send_response(206)
+                self.send_header("Content-type", "multipart/byteranges; boundary=" + self.range_boundary)
+                self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+            self.end_headers()
+            self.ranges = ranges
+            return f
+        except:
+            f.close()
+            raise
+
+    def send_metrics(self):
+        """Prometheus text exposition of METRICS"""
+        extra = []
+        if self.filename_index is not None:
+            extra.append(('webshare_search_index_paths', 'gauge', 'Paths in the filename search index.',
+                          len(self.filename_index.snapshot[0])))
+        extra.append(('webshare_listing_snapshots', 'gauge', 'Directory listings held in the snapshot cache.',
+                      len(self.snapshots.snapshots)))
+        if self.worker is not None:
+            # Each worker process has its own counters: tell them apart
+            extra.append(('webshare_worker_process', 'gauge', 'Number of the pre-fork worker process that answered.',
+                          self.worker.number))
+        self.send_compressible(METRICS.render(extra).encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8',
+                               headers=[('Cache-Control', 'no-store')])
+
+    def send_static(self, asset):
+        """Send the headers of a built-in asset and return its body"""
+        if asset is None:
+            self.send_error(404, "File not found")
+            return None
+        # The URL changes with the content, so it can be cached for good
+        self.send_response(200)
+        self.send_header("Content-type", asset.content_type)
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.send_header("ETag", asset.etag)
+        self.send_header("Vary", "Accept-Encoding")
+        body = asset.data
+        if self.accepts_gzip():
+            body = asset.gzipped
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return BytesIO(body)
+
+    def accepts_gzip(self):
+        """Whether the client's Accept-Encoding allows a gzip response"""
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            if name.strip().lower() in ('gzip', 'x-gzip'):
+                params = params.replace(' ', '').lower()
+                if params.startswith('q='):
+                    try:
+                        return float(params[2:]) > 0
+                    except ValueError:
+                        return False
+                return True
+        return False
+
+    def send_html(self, html, code=200, headers=()):
+        """Send a complete HTML page, gzip-compressed when the client accepts it"""
+        self.send_compressible(html.encode('utf-8', 'replace'), 'text/html; charset=utf-8', code, headers)
+
+    def send_json(self, obj, code=200, headers=()):
+        import json
+        self.send_compressible(json.dumps(obj).encode('utf-8'), 'application/json', code, headers)
+
+    def send_compressible(self, body, content_type, code=200, headers=()):
+        """Send a complete response body, gzip-compressed when the client accepts it"""
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        self.send_header('Vary', 'Accept-Encoding')
+        if len(body) >= GZIP_MIN_SIZE and self.accepts_gzip():
+            body = gzip_compress(body, 6)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def handle_api(self):
+        """Dispatch /__webshare__/api/<name>[/<args>...]?<query>.
+
+        GET and HEAD go to api_<name>, other methods to api_<name>_<method>,
+        called with the query parameters and the remaining path segments.
+        For HEAD, send_compressible leaves the body out.
+        """
+        route, _, query = self.path[len(API_PREFIX):].partition('?')
+        args = [unquote(arg) for arg in route.split('/')]
+        name = 'api_' + args.pop(0).replace('-', '_')
+        if self.command not in ('GET', 'HEAD'):
+            name += '_' + self.command.lower()
+        handler = getattr(self, name, None) if name.isidentifier() else None
+        if handler is not None:
+            self.route = name
+        if handler is None:
+            self.close_connection = True
+            self.send_json({'error': 'Unknown API endpoint'}, 404)
+            return
+        params = dict((key, values[-1]) for key, values in parse_qs(query).items())
+        try:
+            handler(params, args)
+        except (LookupError, FileNotFoundError, NotADirectoryError) as e:
+            self.send_json({'error': str(e)}, 404)
+        except PermissionError as e:
+            self.send_json({'error': str(e)}, 403)
+        except (ValueError, re.error) as e:
+            self.send_json({'error': str(e)}, 400)
+        except OSError as e:
+            self.send_json({'error': str(e)}, 500)
+
+    def read_json_body(self):
+        import json
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except UnicodeError:
+            raise ValueError('Request body is not UTF-8')
+
+    def api_list(self, params, args):
+        """One page of a directory listing.
+
+        Query: path (URL path of the directory, default /), sort (name, type,
+        size or mtime), order (asc or desc), filter (case-insensitive name
+        substring), limit and cursor (next_cursor of the previous page).
+        """
+        url_path = params.get('path', '/')
+        sort = params.get('sort', 'name')
+        if sort not in LISTING_SORT_KEYS:
+            raise ValueError('sort must be one of %s' % ', '.join(sorted(LISTING_SORT_KEYS)))
+        descending = params.get('order', 'asc') == 'desc'
+        limit = min(max(int(params.get('limit', LISTING_PAGE_SIZE)), 1), MAX_LISTING_PAGE_SIZE)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        name_filter = params.get('filter', '')
+
+        path = self.translate_path(url_path)
+        if not os.path.isdir(path):
+            raise NotADirectoryError('Not a directory: %s' % url_path)
+        snapshot = self.snapshots.get(path, self._scan)
+        try:
+            entries, next_key = snapshot.page(sort, descending, cursor, name_filter, limit)
+        except TypeError:
+            # Cursor built for another sort key
+            raise ValueError('Cursor does not match the requested sort')
+        self.send_json({
+            'path': url_path,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+            'filter': name_filter,
+            'total': snapshot.count(name_filter),
+            'entries': [self._entry_json(entry) for entry in entries],
+            'next_cursor': None if next_key is None else encode_cursor(next_key),
+        }, headers=[('Cache-Control', 'no-cache')])
+
+    def api_limits(self, params, args):
+        """Current bandwidth limits in bytes per second, 0 meaning unlimited"""
+        self.send_json(self.limiter.limits, headers=[('Cache-Control', 'no-store')])
+
+    def api_limits_put(self, params, args):
+        """Change bandwidth limits at runtime, with the token of the server's token file.
+
+        Header: Authorization: Bearer <token>. Body: any of down, up,
+        client_down, client_up, as bytes per second or strings such as "10M".
+        """
+        if self.worker is not None:
+            # Only the worker process answering this request would see the change
+            raise ValueError('Limits cannot be changed at runtime with --processes, restart the server instead')
+        import hmac  # only needed here, kept out of startup
+        import json
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        if (self.control_token is None or scheme.lower() != 'bearer'
+                or not hmac.compare_digest(token.strip().encode(), self.control_token.encode())):
+            # Clients of an ssh -L tunnel connect from the loopback address too: the address proves nothing
+            raise PermissionError('Changing limits requires the token from the server\'s token file')
+        limits = self.read_json_body()
+        if not isinstance(limits, dict):
+            raise ValueError('Expected a JSON object')
+        self.limiter.configure(limits)
+        self.log_message("Bandwidth limits changed: %s", json.dumps(self.limiter.limits))
+        self.api_limits(params, args)
+
+    def api_search(self, params, args):
+        """Recursive filename search below the served directory.
+
+        Query: q (case-insensitive substring, or glob when it contains
+        *, ? or [) and limit.
+        """
+        index = self.filename_index
+        if index is None:
+            self.send_json({'error': 'Search index is disabled'}, 503)
+            return
+        # Pre-fork workers only index the tree once searched
+        index.start()
+        query = params.get('q', '').strip()
+        if not query:
+            raise ValueError('Missing query')
+        limit = min(max(int(params.get('limit', 200)), 1), 5000)
+        started = time.time()
+        results, truncated = index.search(query, limit)
+        self.send_json({
+            'query': query,
+            'indexing': not index.ready,
+            'indexed': len(index),
+            'truncated': truncated,
+            'took_ms': round((time.time() - started) * 1000, 1),
+            'results': [{
+                'path': path,
+                'href': '/' + quote(path.replace(os.sep, '/')) + ('/' if is_dir else ''),
+                'is_dir': is_dir,
+            } for path, is_dir in results],
+        }, headers=[('Cache-Control', 'no-cache')])
+
+    def api_checksums(self, params, args):
+        """Checksums of a file, or of every file below a directory.
+
+        Query: path (URL path, default /), algorithm (sha256 or crc32),
+        recursive (0 for the files directly in the directory) and format
+        (json, or text: a manifest for sha256sum -c, streamed as files are
+        hashed). Names are relative to the directory.
+        """
+        url_path = params.get('path', '/')
+        path = os.path.normpath(self.translate_path(url_path))
+        if not os.path.exists(path):
+            raise FileNotFoundError('No such file or directory: %s' % url_path)
+        base = path if os.path.isdir(path) else os.path.dirname(path)
+        self.send_checksums(url_path, [path], base, params)
+
+    def api_checksums_post(self, params, args):
+        """Checksums of a selection.
+
+        Body: {"paths": [URL paths], "algorithm": ...}; query as for GET.
+        Names are relative to the served directory.
+        """
+        request = self.read_json_body()
+        paths = request.get('paths') if isinstance(request, dict) else None
+        if not isinstance(paths, list) or not paths:
+            raise ValueError('Expected a JSON object with a non-empty list of paths')
+        full_paths = []
+        for url_path in paths:
+            path = os.path.normpath(self.translate_path(str(url_path)))
+            if not os.path.exists(path):
+                raise FileNotFoundError('No such file or directory: %s' % url_path)
+            full_paths.append(path)
+        if 'algorithm' in request:
+            params['algorithm'] = str(request['algorithm'])
+        self.send_checksums(None, full_paths, os.getcwd(), params)
+
+    def send_checksums(self, url_path, paths, base, params):
+        algorithm = params.get('algorithm', 'sha256')
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ValueError('algorithm must be one of %s' % ', '.join(CHECKSUM_ALGORITHMS))
+        output = params.get('format', 'json')
+        if output not in ('json', 'text'):
+            raise ValueError('format must be json or text')
+        files = self._checksum_files(paths, base, params.get('recursive', '1') != '0')
+        results = self._iter_checksums(files, algorithm)
+        started = time.time()
+        if output == 'text':
+            self.send_checksum_manifest(results)
+            return
+        entries, errors = [], []
+        hashed = 0
+        for name, size, checksum, cached, error in results:
+            if error is not None:
+                errors.append({'path': name, 'error': error})
+                continue
+            entries.append({'path': name, 'size': size, 'checksum': checksum, 'cached': cached})
+            if not cached:
+                hashed += size
+        self.send_json({
+            'path': url_path,
+            'algorithm': algorithm,
+            'count': len(entries),
+            'cached': sum(1 for entry in entries if entry['cached']),
+            'bytes_hashed': hashed,
+            'took_ms': round((time.time() - started) * 1000, 1),
+            'files': entries,
+            'errors': errors,
+        }, headers=[('Cache-Control', 'no-cache')])
+
+    def send_checksum_manifest(self, results):
+        """Stream checksum results as "<checksum>  <name>" lines, the format of sha256sum"""
+        out = self.start_chunked_response(200, [
+            ('Content-type', 'text/plain; charset=utf-8'),
+            ('Cache-Control', 'no-cache'),
+        ])
+        if self.command == 'HEAD':
+            # The headers of the GET response, without hashing anything
+            return
+        try:
+            for name, size, checksum, cached, error in results:
+                if error is not None:
+                    # Too late for an error status: leave the file out of the manifest
+                    self.log_error("checksums: skipping %s: %s", name, error)
+                    continue
+                line = '%s  %s\n' % (checksum, name)
+                if '\\' in name or '\n' in name:
+                    # sha256sum escapes such names and marks the line with a backslash
+                    line = '\\%s  %s\n' % (checksum, name.replace('\\', '\\\\').replace('\n', '\\n'))
+                out.write(line.encode('utf-8', 'surrogateescape'))
+            out.close()
+        except Exception as e:
+            # Headers are already sent: cut the stream so the client sees an incomplete manifest
+            self.close_connection = True
+            self.log_error("checksum manifest aborted: %s", e)
+
+    def _checksum_files(self, paths, base, recursive):
+        """Yield (path, name relative to base) for the regular files in or below paths"""
+        for top in paths:
+            if not os.path.isdir(top):
+                if os.path.isfile(top):
+                    yield top, os.path.relpath(top, base).replace(os.sep, '/')
+                continue
+            for root, dirs, files in os.walk(top):
+                if not recursive:
+                    del dirs[:]
+                dirs.sort()
+                for name in sorted(files):
+                    full_path = os.path.join(root, name)
+                    if os.path.isfile(full_path):
+                        yield full_path, os.path.relpath(full_path, base).replace(os.sep, '/')
+
+    def _iter_checksums(self, files, algorithm):
+        """Yield (name, size, checksum, cached, error) for (path, name) files, in order.
+
+        Cached checksums are answered from the ChecksumCache; the other files
+        are hashed on the hashing pool, a bounded number at a time.
+        """
+        pool = self.checksum_pool()
+        # Results in order: finished tuples, or futures of the files being hashed
+        pending = deque()
+        try:
+            for full_path, name in files:
+                try:
+                    st = os.stat(full_path)
+                except OSError as e:
+                    pending.append((name, 0, None, False, e.strerror or str(e)))
+                    continue
+                checksum = self._cached_checksum(full_path, st, algorithm)
+                if checksum:
+                    pending.append((name, st.st_size, checksum, True, None))
+                else:
+                    pending.append(pool.submit(self._hash_file, full_path, name, algorithm))
+                while pending and (len(pending) > 4 * self.hash_threads
+                                   or isinstance(pending[0], tuple) or pending[0].done()):
+                    item = pending.popleft()
+                    yield item if isinstance(item, tuple) else item.result()
+            while pending:
+                item = pending.popleft()
+                yield item if isinstance(item, tuple) else item.result()
+        finally:
+            for item in pending:
+                if not isinstance(item, tuple):
+                    item.cancel()
+
+    def _cached_checksum(self, path, st, algorithm):
+        if self.checksum_cache is None:
+            return None
+        import sqlite3
+        try:
+            return self.checksum_cache.get(st, algorithm)
+        except sqlite3.Error as e:
+            self.log_error("Checksum cache lookup failed for %s: %s", path, e)
+            return None
+
+    def _hash_file(self, path, name, algorithm):
+        """Checksum result of one file, recorded in the ChecksumCache unless it changed meanwhile"""
+        try:
+            checksum, st = file_checksum(path, algorithm)
+            if st is None:
+                return name, os.stat(path).st_size, checksum, False, None
+        except OSError as e:
+            return name, 0, None, False, e.strerror or str(e)
+        if self.checksum_cache is not None:
+            import sqlite3
+            try:
+                self.checksum_cache.put(st, algorithm, checksum)
+            except sqlite3.Error as e:
+                self.log_error("Checksum cache update failed for %s: %s", path, e)
+        return name, st.st_size, checksum, False, None
+
+    def checksum_pool(self):
+        """Thread pool shared by all checksum requests, created on first use"""
+        with self.hash_pool_lock:
+            if FileUploadHandler.hash_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                FileUploadHandler.hash_pool = ThreadPoolExecutor(self.hash_threads)
+            return FileUploadHandler.hash_pool
+
+    def api_uploads_post(self, params, args):
+        """Chunked uploads: create or resume a session, or commit one.
+
+        POST uploads with a JSON body {path, size, fingerprint, chunk_size}
+        returns the session; creating it again with the same values resumes
+        it. POST uploads/<id>/commit moves the completed file into place.
+        """
+        if self.uploads is None:
+            self.send_json({'error': 'Chunked uploads are disabled'}, 503)
+            return
+        if not args or args == ['']:
+            request = self.read_json_body()
+            try:
+                session = self.uploads.create(
+                    str(request['path']),
+                    int(request['size']),
+                    str(request.get('fingerprint', '')),
+                    int(request.get('chunk_size') or UPLOAD_CHUNK_SIZE),
+                )
+            except (KeyError, TypeError, AttributeError) as e:
+                raise ValueError('Expected a JSON object with path and size: %s' % e)
+            self.send_json(session.status(os.getcwd()))
+        elif len(args) == 2 and args[1] == 'commit':
+            session = self.uploads.get(args[0])
+            session.commit()
+            self.uploads.discard(session)
+            self.send_json({'path': os.path.relpath(session.path, os.getcwd()), 'size': session.size})
+        else:
+            raise LookupError('Unknown upload action')
+
+    def api_uploads(self, params, args):
+        """GET uploads/<id>: session status, with the chunks already received"""
+        if self.uploads is None:
+            self.send_json({'error': 'Chunked uploads are disabled'}, 503)
+            return
+        self.send_json(self.uploads.get(args[0] if args else '').status(os.getcwd()),
+                       headers=[('Cache-Control', 'no-cache')])
+
+    def api_uploads_put(self, params, args):
+        """PUT uploads/<id>?offset=N with one chunk as the request body"""
+        if self.uploads is None:
+            self.close_connection = True
+            self.send_json({'error': 'Chunked uploads are disabled'}, 503)
+            return
+        if self.headers.get('Content-Length') is None:
+            self.close_connection = True
+            self.send_json({'error': 'Content-Length is required'}, 411)
+            return
+        try:
+            session = self.uploads.get(args[0] if args else '')
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError('Invalid Content-Length: %d' % length)
+            session.write_chunk(int(params.get('offset', 0)), self.rfile, length)
+        except Exception:
+            # The body may be left unread: do not reuse the connection
+            self.close_connection = True
+            raise
+        self.send_json({'received': len(session.received), 'chunks': session.chunk_count})
+
+    def api_uploads_delete(self, params, args):
+        """DELETE uploads/<id>: abort a session and drop its data"""
+        if self.uploads is None:
+            self.send_json({'error': 'Chunked uploads are disabled'}, 503)
+            return
+        session = self.uploads.get(args[0] if args else '')
+        session.abort()
+        self.uploads.discard(session)
+        self.send_json({'aborted': session.upload_id})
+
+    def _entry_json(self, entry):
+        return {
+            'name': entry.name,
+            'href': quote(entry.name) + ('/' if entry.is_dir else ''),
+            'path': entry.path,
+            'is_dir': entry.is_dir,
+            'is_link': entry.is_link,
+            'size': entry.size,
+            'mtime': entry.mtime,
+            'modified': None if entry.mtime is None else self._format_date(entry.mtime),
+            'type': entry.file_type,
+            'icon': entry.icon,
+        }
+
+    def _scan(self, path, dir_entries=None):
+        start = time.perf_counter()
+        try:
+            if dir_entries is not None:
+                return list(listing_entries(dir_entries, self._directory_size))
+            return scan_directory(path, self._directory_size)
+        finally:
+            METRICS.observe_walk('listing', time.perf_counter() - start)
+
+    def _not_modified(self, etag, mtime):
+        """Whether the request's conditional headers allow a 304 for this validator"""
+        if "If-None-Match" in self.headers:
+            # Weak comparison, and If-Modified-Since is then ignored (RFC 7232 section 6)
+            candidates = [tag.strip() for tag in self.headers["If-None-Match"].split(',')]
+            return '*' in candidates or weak_etag(etag) in [weak_etag(tag) for tag in candidates]
+        if "If-Modified-Since" not in self.headers:
+            return False
+        from email.utils import parsedate_to_datetime
+        try:
+            ims = parsedate_to_datetime(self.headers["If-Modified-Since"])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            # ignore ill-formed values
+            return False
+        if ims.tzinfo is None:
+            # obsolete format with no timezone, cf. RFC 7231 section 7.1.1.1
+            ims = ims.replace(tzinfo=timezone.utc)
+        return int(mtime) <= ims.timestamp()
+
+    def send_not_modified(self, etag, mtime):
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.end_headers()
+
+    def _if_range_matches(self, etag, fs):
+        """Whether a Range may be honoured given the If-Range header, if any"""
+        validator = self.headers.get('If-Range')
+        if not validator:
+            return True
+        validator = validator.strip()
+        if validator.startswith('"') or validator.startswith('W/'):
+            # Strong comparison: a weak tag never matches
+            return validator == etag
+        from email.utils import parsedate_to_datetime
+        try:
+            date = parsedate_to_datetime(validator)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if date.tzinfo is None:
+            return False
+        return int(date.timestamp()) == int(fs.st_mtime)
+
+    def _range_trailer(self):
+        return ('\r\n--%s--\r\n' % self.range_boundary).encode('latin-1')
+
+    def copy_ranges(self, source, outputfile):
+        """Copy the ranges selected by send_head from source to outputfile"""
+        multipart = len(self.ranges) > 1
+        for index, (start, end) in enumerate(self.ranges):
+            if multipart:
+                outputfile.write(self.range_parts[index])
+            self.copy_file_range(source, outputfile, start, end - start + 1)
+        if multipart:
+            outputfile.write(self._range_trailer())
+
+    def copyfile(self, source, outputfile):
+        """Copy a whole file, zero-copy when it goes straight to the client socket"""
+        if self._zero_copy(source, outputfile):
+            outputfile.flush()
+            outputfile.count += self._sendfile(source, source.tell())
+        else:
+            SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+
+    def copy_file_range(self, source, outputfile, offset, count):
+        """Copy count bytes of source starting at offset to outputfile"""
+        if self._zero_copy(source, outputfile):
+            outputfile.flush()
+            sent = self._sendfile(source, offset, count)
+            outputfile.count += sent
+        else:
+            source.seek(offset)
+            sent = 0
+            while sent < count:
+                data = source.read(min(CHUNK_SIZE, count - sent))
+                if not data:
+                    break
+                outputfile.write(data)
+                sent += len(data)
+        if sent < count:
+            # File shrank while being sent: the announced length can no longer be met
+            raise OSError("File truncated while sending bytes %d-%d" % (offset, offset + count - 1))
+
+    def _sendfile(self, source, offset, count=None):
+        """socket.sendfile, in throttled CHUNK_SIZE slices when downloads are rate limited"""
+        if not self.limiter.limited('down'):
+            return self.connection.sendfile(source, offset, count)
+        sent = 0
+        while count is None or sent < count:
+            size = CHUNK_SIZE if count is None else min(CHUNK_SIZE, count - sent)
+            self.wfile.throttle(size)
+            n = self.connection.sendfile(source, offset + sent, size)
+            if not n:
+                break
+            sent += n
+        return sent
+
+    def _zero_copy(self, source, outputfile):
+        # socket.sendfile() uses os.sendfile and falls back to plain send()
+        # by itself when the file or socket does not support it
+        return self.use_sendfile and outputfile is self.wfile and hasattr(source, 'fileno')
+
+    def do_PUT(self):
+        if self.path.startswith(API_PREFIX):
+            self.handle_api()
+        else:
+            self.send_error(405, "Method not allowed")
+
+    def do_DELETE(self):
+        if self.path.startswith(API_PREFIX):
+            self.handle_api()
+        else:
+            self.send_error(405, "Method not allowed")
+
+    def do_POST(self):
+        if self.path.startswith(API_PREFIX):
+            self.handle_api()
+            return
+        if self.path == '/upload':
+            self.route = 'upload'
+            try:
+                content_type, params = parse_header_params(self.headers.get('Content-Type', ''))
+                if content_type != 'multipart/form-data' or not params.get('boundary'):
+                    raise ValueError('Expected a multipart/form-data request')
+                content_length = int(self.headers['Content-Length'])
+                form = MultipartParser(self.rfile, params['boundary'].encode('latin-1'), content_length)
+
+                uploaded_files = []
+                parse_start = time.perf_counter()
+                # Files are written as their parts arrive (including directory structure)
+                for item in form:
+                    if item.name == 'uploaded[]' and not item.filename:
+                        # Sent by the page for files already transferred in chunks
+                        uploaded_files.append(item.read().decode('utf-8', 'replace'))
+                        continue
+                    if item.name != 'file[]' or not item.filename:
+                        continue
+                    try:
+                        filepath = contained_path(os.getcwd(), item.filename)
+                        # Create directory structure if needed
+                        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                        f = open(filepath, 'wb')
+                    except (OSError, ValueError) as e:
+                        self.close_connection = True
+                        self.send_error_page(
+                            "Upload Error",
+                            f"Error uploading {item.filename}",
+                            str(e),
+                            "The file might already exist or you don't have permission to write in this location."
+                        )
+                        return
+                    try:
+                        with f:
+                            for chunk in item:
+                                f.write(chunk)
+                    except Exception:
+                        # Do not leave a truncated file behind
+                        os.remove(filepath)
+                        raise
+                    uploaded_files.append(item.filename)
+                METRICS.observe_section('upload_multipart', time.perf_counter() - parse_start)
+
+                response = '''
+                <!DOCTYPE html>
+                <html>
+                <head>
+                    <meta charset="utf-8">
+                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                    <title>Upload Success</title>
+                    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">
+                    <style>
+                        :root {
+                            --bg-color: #1a1b1e;
+                            --card-bg: #25262b;
+                            --text-color: #c1c2c5;
+                            --accent-color: #22c55e;
+                            --border-color: #2c2d31;
+                        }
+                        
+                        body {
+                            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
+                            line-height: 1.5;
+                            color: var(--text-color);
+                            background: var(--bg-color);
+                            margin: 0;
+                            padding: 24px;
+                            font-size: 14px;
+                        }
+                        
+                        .container {
+                            max-width: 600px;
+                            margin: 0 auto;
+                            background: var(--card-bg);
+                            border-radius: 12px;
+                            padding: 24px;
+                            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
+                        }
+                        
+                        .success-icon {
+                            font-size: 48px;
+                            color: var(--accent-color);
+                            margin-bottom: 16px;
+                            text-align: center;
+                        }
+                        
+                        h2 {
+                            color: var(--text-color);
+                            margin: 0 0 16px 0;
+                            text-align: center;
+                        }
+                        
+                        ul {
+                            list-style: none;
+                            padding: 0;
+                            margin: 16px 0;
+                        }
+                        
+                        li {
+                            padding: 8px 0;
+                            border-bottom: 1px solid var(--border-color);
+                        }
+                        
+                        li:last-child {
+                            border-bottom: none;
+                        }
+                        
+                        .btn {
+                            display: inline-flex;
+                            align-items: center;
+                            gap: 8px;
+                            padding: 10px 20px;
+                            font-size: 14px;
+                            font-weight: 500;
+                            color: #fff;
+                            background: var(--accent-color);
+                            border: none;
+                            border-radius: 8px;
+                            cursor: pointer;
+                            text-decoration: none;
+                            transition: all 0.3s ease;
+                        }
+                        
+                        .btn:hover {
+                            opacity: 0.9;
+                            transform: translateY(-1px);
+                        }
+                        
+                        .center {
+                            text-align: center;
+                            margin-top: 24px;
+                        }
+                    </style>
+                </head>
+                <body>
+                    <div class="container">
+                        <div class="success-icon">
+                            <i class="fas fa-check-circle"></i>
+                        </div>
+                        <h2>Upload Successful!</h2>
+                '''
+                if len(uploaded_files) > 1:
+                    response += f'<p>{len(uploaded_files)} files were uploaded successfully:</p><ul>'
+                    for f in uploaded_files:
+                        response += f'<li><i class="fas fa-file"></i> {f}</li>'
+                    response += '</ul>'
+                elif len(uploaded_files) == 1:
+                    response += f'<p><i class="fas fa-file"></i> {uploaded_files[0]} was uploaded successfully.</p>'
+                else:
+                    response += '<p>No files were uploaded.</p>'
+                
+                response += '''
+                        <div class="center">
+                            <a href="/" class="btn">
+                                <i class="fas fa-arrow-left"></i> Back to Files
+                            </a>
+                        </div>
+                    </div>
+                </body>
+                </html>'''
+                
+                self.send_html(response)
+                return
+            except Exception as e:
+                self.close_connection = True
+                self.send_error_page(
+                    "Upload Error",
+                    "Failed to process upload",
+                    str(e),
+                    "There was an error processing your upload request. Please try again."
+                )
+                return
+        elif self.path.split('?', 1)[0] == '/download-selected':
+            self.route = 'zip'
+            import json
+            try:
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length).decode('utf-8')
+                files = self._selected_paths(json.loads(post_data))
+                archive = parse_qs(self.path.partition('?')[2]).get('format', ['zip'])[-1]
+                if archive != 'zip' and archive not in ARCHIVE_FORMATS:
+                    raise ValueError('Unsupported archive format: %s' % archive)
+            except Exception as e:
+                self.send_error_page(
+                    "Download Error",
+                    "Failed to create download",
+                    str(e),
+                    "There was an error creating the zip file for download. Please try again.",
+                    400 if isinstance(e, ValueError) else 500
+                )
+                return
+
+            if archive != 'zip':
+                self.route = 'tar'
+                self.send_tar(self._iter_tree(files), 'selected_files.' + archive, archive)
+                return
+
+            # Stream the ZIP as entries are compressed
+            out = self.start_chunked_response(200, [
+                ('Content-type', 'application/zip'),
+                ('Content-Disposition', 'attachment; filename=\"selected_files.zip\"'),
+            ])
+            try:
+                with timed('zip_stream'):
+                    zip_file = ZipStream(out, self.compression_pool(), self.zip_level, 2 * self.zip_threads)
+                    for full_path, arcname in self._iter_selected(files):
+                        try:
+                            f = open(full_path, 'rb')
+                        except OSError as e:
+                            # Vanished or unreadable: skip it rather than cut the whole archive
+                            self.log_error("ZIP: skipping %s: %s", full_path, e)
+                            continue
+                        with f:
+                            zip_file.write_file(f, arcname)
+                    zip_file.close()
+                out.close()
+            except Exception as e:
+                # Headers are already sent: cut the stream so the client sees an incomplete download
+                self.close_connection = True
+                self.log_error("ZIP download aborted: %s", e)
+            return
+
+    def compression_pool(self):
+        """Thread pool shared by all ZIP downloads, created on first use"""
+        with self.zip_pool_lock:
+            if FileUploadHandler.zip_pool is None:
+                # Imported on first use: it costs more startup time than anything else here
+                from concurrent.futures import ThreadPoolExecutor
+                FileUploadHandler.zip_pool = ThreadPoolExecutor(self.zip_threads)
+            return FileUploadHandler.zip_pool
+
+    def send_directory_archive(self, path, params):
+        """Stream a directory, or its entries named by path=, as ?archive=tar|tar.gz"""
+        archive = params['archive'][-1]
+        if archive not in ARCHIVE_FORMATS:
+            self.send_error(400, "Unsupported archive format")
+            return
+        path = os.path.normpath(path)
+        if 'path' not in params:
+            name = os.path.basename(path) or 'root'
+            self.send_tar(self._iter_tree([path]), '%s.%s' % (name, archive), archive)
+            return
+        paths = []
+        for name in params['path']:
+            full_path = os.path.normpath(os.path.join(path, name))
+            if not full_path.startswith(os.path.join(path, '')):
+                self.send_error(400, "Path outside of the directory")
+                return
+            if not os.path.lexists(full_path):
+                self.send_error(404, "File not found")
+                return
+            paths.append(full_path)
+        name = os.path.basename(path) or 'root'
+        self.send_tar(self._iter_tree(paths), '%s-selected.%s' % (name, archive), archive)
+
+    def send_tar(self, members, filename, archive):
+        """Stream (path, archive name) members as a tar archive in the given format"""
+        import tarfile  # only needed here, kept out of startup
+        compress, content_type = ARCHIVE_FORMATS[archive]
+        out = self.start_chunked_response(200, [
+            ('Content-type', content_type),
+            ('Content-Disposition', content_disposition(filename)),
+        ])
+        if self.command == 'HEAD':
+            return
+        try:
+            start = time.perf_counter()
+            stream = out
+            if compress:
+                stream = GzipStream(out, self.compression_pool(), self.zip_level, 2 * self.zip_threads)
+            with tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for full_path, arcname in members:
+                    try:
+                        info = tar.gettarinfo(full_path, arcname)
+                        f = open(full_path, 'rb') if info is not None and info.isreg() else None
+                    except OSError as e:
+                        # Vanished or unreadable: skip it rather than cut the whole archive
+                        self.log_error("tar: skipping %s: %s", full_path, e)
+                        continue
+                    if info is None:  # sockets cannot be archived
+                        continue
+                    try:
+                        tar.addfile(info, f)
+                    finally:
+                        if f:
+                            f.close()
+            if compress:
+                stream.close()
+            METRICS.observe_section('tar_stream', time.perf_counter() - start)
+            out.close()
+        except Exception as e:
+            # Headers are already sent: cut the stream so the client sees an incomplete download
+            self.close_connection = True
+            self.log_error("tar download aborted: %s", e)
+
+    def _selected_paths(self, paths):
+        """Paths of a download selection, refusing any that resolves outside of the served directory"""
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError('Expected a JSON list of paths')
+        root = os.getcwd()
+        for path in paths:
+            contained_path(root, path)
+        # Checked once resolved, but kept as given: archive names and symbolic links stay as selected
+        return [os.path.join(root, path) for path in paths]
+
+    def _iter_tree(self, paths):
+        """Yield (path, archive name) for paths and everything below them.
+
+        Unlike _iter_selected, directories and symbolic links are members of
+        their own, so that a tar archive restores the tree as it was.
+        """
+        for top in paths:
+            base = os.path.dirname(os.path.normpath(top))
+            if not os.path.isdir(top) or os.path.islink(top):
+                yield top, os.path.relpath(top, base)
+                continue
+            for root, dirs, files in os.walk(top):
+                yield root, os.path.relpath(root, base)
+                # os.walk does not descend into symlinked directories
+                links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+                for name in links + files:
+                    full_path = os.path.join(root, name)
+                    yield full_path, os.path.relpath(full_path, base)
+
+    def _iter_selected(self, paths):
+        """Yield (path, archive name) for every file in a download selection"""
+        for file_path in paths:
+            if os.path.exists(file_path):
+                if os.path.isdir(file_path):
+                    # Walk through directory
+                    for root, dirs, files in os.walk(file_path):
+                        for file in files:
+                            full_path = os.path.join(root, file)
+                            arcname = os.path.relpath(full_path, os.path.dirname(file_path))
+                            yield full_path, arcname
+                else:
+                    # Single file
+                    yield file_path, os.path.basename(file_path)
+
+    def start_chunked_response(self, code, headers):
+        """Send headers for a body of unknown length and return a writer for it"""
+        # HTTP/1.0 clients cannot decode chunks: fall back to close-delimited body
+        chunked = self.request_version != 'HTTP/1.0'
+        if not chunked:
+            self.close_connection = True
+        self.send_response(code)
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked)
+
+    def send_error_page(self, title, heading, error_message, suggestion, code=500):
+        """Send a custom error page"""
+        error_html = f'''
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <title>{title}</title>
+            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">
+            <style>
+                :root {{
+                    --bg-color: #1a1b1e;
+                    --card-bg: #25262b;
+                    --text-color: #c1c2c5;
+                    --error-color: #ef4444;
+                    --border-color: #2c2d31;
+                }}
+                
+                body {{
+                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Noto Sans", Helvetica, Arial, sans-serif;
+                    line-height: 1.5;
+                    color: var(--text-color);
+                    background: var(--bg-color);
+                    margin: 0;
+                    padding: 24px;
+                    font-size: 14px;
+                }}
+                
+                .container {{
+                    max-width: 600px;
+                    margin: 0 auto;
+                    background: var(--card-bg);
+                    border-radius: 12px;
+                    padding: 24px;
+                    box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1);
+                }}
+                
+                .error-icon {{
+                    font-size: 48px;
+                    color: var(--error-color);
+                    margin-bottom: 16px;
+                    text-align: center;
+                }}
+                
+                h2 {{
+                    color: var(--text-color);
+                    margin: 0 0 16px 0;
+                    text-align: center;
+                }}
+                
+                .error-details {{
+                    background: rgba(239, 68, 68, 0.1);
+                    border: 1px solid var(--error-color);
+                    border-radius: 8px;
+                    padding: 16px;
+                    margin: 16px 0;
+                    color: var(--text-color);
+                }}
+                
+                .suggestion {{
+                    color: #6b7280;
+                    margin: 16px 0;
+                    padding: 16px;
+                    border-left: 4px solid var(--border-color);
+                }}
+                
+                .btn {{
+                    display: inline-flex;
+                    align-items: center;
+                    gap: 8px;
+                    padding: 10px 20px;
+                    font-size: 14px;
+                    font-weight: 500;
+                    color: #fff;
+                    background: var(--error-color);
+                    border: none;
+                    border-radius: 8px;
+                    cursor: pointer;
+                    text-decoration: none;
+                    transition: all 0.3s ease;
+                }}
+                
+                .btn:hover {{
+                    opacity: 0.9;
+                    transform: translateY(-1px);
+                }}
+                
+                .center {{
+                    text-align: center;
+                    margin-top: 24px;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="error-icon">
+                    <i class="fas fa-exclamation-circle"></i>
+                </div>
+                <h2>{heading}</h2>
+                <div class="error-details">
+                    <strong>Error:</strong> {error_message}
+                </div>
+                <div class="suggestion">
+                    <i class="fas fa-lightbulb"></i> {suggestion}
+                </div>
+                <div class="center">
+                    <a href="/" class="btn">
+                        <i class="fas fa-arrow-left"></i> Back to Files
+                    </a>
+                </div>
+            </div>
+        </body>
+        </html>
+        '''
+        
+        self.send_html(error_html, code)
+
+    def list_directory(self, path):
+        try:
+            dir_stat, snapshot = self.snapshots.lookup(path)
+            if snapshot is None:
+                with os.scandir(path) as it:
+                    dir_entries = sorted(it, key=dir_entry_order)
+        except OSError:
+            self.send_error(404, 'No permission to list directory')
+            return None
+        if snapshot is None:
+            if self.command == 'GET' and not (
+                    'If-None-Match' in self.headers or 'If-Modified-Since' in self.headers) and (
+                    len(dir_entries) > LISTING_STREAM_MIN_ENTRIES or not self._sizes_cached(dir_entries)):
+                # Big directory or size walks ahead: rows go out as they are stat'ed
+                self.stream_directory(path, dir_stat, dir_entries)
+                return None
+            snapshot = self.snapshots.store(path, dir_stat, self._scan(path, dir_entries))
 
-        function downloadSelected() {
-            const checkboxes = document.getElementsByName('file-select');
-            const selectedFiles = [];
-            
-            for (let checkbox of checkboxes) {
-                if (checkbox.checked) {
-                    selectedFiles.push(checkbox.value);
-                }
-            }
+        etag = snapshot.etag
+        mtime = max([snapshot.dir_stat.st_mtime] +
+                    [entry.mtime for entry in snapshot.entries if entry.mtime is not None])
+        # Huge directories only get their first page here, the script fetches the rest
+        entries, next_key = snapshot.page()
+        if self._not_modified(etag, mtime):
+            self.send_not_modified(etag, mtime)
+            return None
 
-            if (selectedFiles.length === 0) {
-                alert('Please select at least one item to download');
-                return;
-            }
+        render_start = time.perf_counter()
+        r = self._listing_head()
+        for entry in entries:
+            r.extend(self._render_row(entry))
+        r.extend(self._listing_tail(next_key, len(snapshot.entries)))
+        html = '\n'.join(r)
+        METRICS.observe_section('listing_render', time.perf_counter() - render_start)
+        # Let browsers keep the page but revalidate it on every visit
+        self.send_html(html, headers=[
+            ('Cache-Control', 'no-cache'),
+            ('ETag', etag),
+            ('Last-Modified', self.date_time_string(mtime)),
+        ])
+        return None
 
-            fetch('/download-selected', {
-                method: 'POST',
-                body: JSON.stringify(selectedFiles)
-            }).then(response => response.blob())
-              .then(blob => {
-                  const url = window.URL.createObjectURL(blob);
-                  const a = document.createElement('a');
-                  a.href = url;
-                  a.download = 'selected_files.zip';
-                  document.body.appendChild(a);
-                  a.click();
-                  window.URL.revokeObjectURL(url);
-              });
-        }
+    def stream_directory(self, path, dir_stat, dir_entries):
+        """Send the listing of path with chunked encoding while stat'ing its sorted os.DirEntry list.
 
-        function sortTable(columnIndex) {
-            const table = document.querySelector('.files-table');
-            const header = table.querySelector(`th:nth-child(${columnIndex + 1})`);
-            const isAsc = !header.classList.contains('sorted-asc');
-            
-            // Remove sorting classes from all headers
-            table.querySelectorAll('th').forEach(th => {
-                th.classList.remove('sorted-asc', 'sorted-desc');
-                const icon = th.querySelector('i');
-                if (icon) {
-                    icon.className = 'fas fa-sort';
-                }
-            });
-            
-            // Add sorting class to clicked header
-            header.classList.add(isAsc ? 'sorted-asc' : 'sorted-desc');
-            const icon = header.querySelector('i');
-            if (icon) {
-                icon.className = `fas fa-sort-${isAsc ? 'up' : 'down'}`;
-            }
-            
-            const tbody = table.querySelector('tbody') || table;
-            const rows = Array.from(tbody.querySelectorAll('tr:not(:first-child)'));
-            
-            const sortedRows = rows.sort((a, b) => {
-                let aValue = a.querySelector(`td:nth-child(${columnIndex + 1})`).textContent.trim();
-                let bValue = b.querySelector(`td:nth-child(${columnIndex + 1})`).textContent.trim();
-                
-                // Handle name column - remove icon from comparison
-                if (columnIndex === 1) {
-                    aValue = aValue.replace(/^[\u{1F300}-\u{1F9FF}]|^[\u2600-\u26FF]|\s+$/gu, '').trim();
-                    bValue = bValue.replace(/^[\u{1F300}-\u{1F9FF}]|^[\u2600-\u26FF]|\s+$/gu, '').trim();
-                }
-                
-                // Handle size sorting
-                if (columnIndex === 3) {
-                    aValue = parseInt(a.querySelector('.size').getAttribute('data-size'));
-                    bValue = parseInt(b.querySelector('.size').getAttribute('data-size'));
-                    return isAsc ? aValue - bValue : bValue - aValue;
-                }
-                
-                // Handle date sorting
-                if (columnIndex === 4) {
-                    aValue = new Date(aValue).getTime();
-                    bValue = new Date(bValue).getTime();
-                    return isAsc ? aValue - bValue : bValue - aValue;
-                }
-                
-                // Default string comparison
-                return isAsc ? 
-                    aValue.localeCompare(bValue, undefined, {numeric: true, sensitivity: 'base'}) :
-                    bValue.localeCompare(aValue, undefined, {numeric: true, sensitivity: 'base'});
-            });
-            
-            // Remove existing rows
-            rows.forEach(row => row.remove());
-            
-            // Add sorted rows
-            sortedRows.forEach(row => tbody.appendChild(row));
-        }
-    </script>''')
+        The page carries no validator: the ETag is only known once it is complete.
+        """
+        start = time.perf_counter()
+        headers = [('Content-type', 'text/html; charset=utf-8'), ('Cache-Control', 'no-cache'),
+                   ('Vary', 'Accept-Encoding')]
+        gzip = self.accepts_gzip()
+        if gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        out = self.start_chunked_response(200, headers)
+        if gzip:
+            out = GzipWriter(out)
+        out.write('\n'.join(self._listing_head()).encode('utf-8', 'replace'))
+        out.flush()
+        entries = []
+        batch = []
+        rows = 0
+        flushed = time.perf_counter()
+        for entry in listing_entries(dir_entries, self._directory_size):
+            entries.append(entry)
+            if len(entries) > LISTING_PAGE_SIZE:
+                continue
+            batch.extend(self._render_row(entry))
+            rows += 1
+            if rows == LISTING_STREAM_BATCH or time.perf_counter() - flushed > LISTING_STREAM_INTERVAL:
+                out.write(('\n' + '\n'.join(batch)).encode('utf-8', 'replace'))
+                out.flush()
+                batch = []
+                rows = 0
+                flushed = time.perf_counter()
+        METRICS.observe_walk('listing', time.perf_counter() - start)
+        snapshot = self.snapshots.store(path, dir_stat, entries)
+        _, next_key = snapshot.page()
+        batch.extend(self._listing_tail(next_key, len(entries)))
+        out.write(('\n' + '\n'.join(batch)).encode('utf-8', 'replace'))
+        out.close()
+
+    def _listing_head(self):
+        """Lines of the listing page up to the table header row"""
+        r = []
+        r.append('<!DOCTYPE html>')
+        r.append('<html>')
+        r.append('<head>')
+        r.append('    <meta charset="utf-8">')
+        r.append('    <meta name="viewport" content="width=device-width, initial-scale=1.0">')
+        r.append('    <title>WebShare</title>')
+        r.append('    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">')
+        r.append('    <link rel="stylesheet" href="{}">'.format(LISTING_CSS.url))
+        r.append('    <script src="{}" defer></script>'.format(LISTING_JS.url))
         r.append('</head>')
         r.append('<body>')
         r.append('    <div class="container">')
@@ -935,7 +4331,7 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
             <i class="fas fa-cloud-upload-alt"></i>
             <h3>Upload Files or Directory</h3>
             <p>Drag & drop files here or select files to upload</p>
-            <form id="uploadForm" enctype="multipart/form-data" method="post" action="/upload">
+            <form id="uploadForm" enctype="multipart/form-data" method="post" action="/upload" onsubmit="return submitUpload(event)">
                 <label for="fileInput" class="file-input-label">
                     <i class="fas fa-folder-open"></i>
                     Choose Files
@@ -948,13 +4344,23 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
             </form>
         </div>''')
         r.append(r'''        <div class="search-container">
-            <input type="text" id="searchBox" class="search-box" placeholder="Search files..." oninput="searchFiles()">
+            <input type="text" id="searchBox" class="search-box" placeholder="Search files... (Enter to search all folders, * and ? allowed)" oninput="searchFiles()" onkeydown="if (event.key === 'Enter') searchEverywhere()">
             <i class="fas fa-search search-icon"></i>
-        </div>''')
+        </div>
+        <div id="search-results" class="hidden"></div>''')
         r.append(r'''        <div class="actions">
             <button onclick="downloadSelected()" class="btn">
                 <i class="fas fa-download"></i> Download Selected
             </button>
+            <button onclick="downloadSelected('tar.gz')" class="btn">
+                <i class="fas fa-file-zipper"></i> Selected as tar.gz
+            </button>
+            <a href="?archive=tar.gz" class="btn" download>
+                <i class="fas fa-box-archive"></i> Folder as tar.gz
+            </a>
+            <button onclick="showChecksums()" class="btn" id="checksums-button">
+                <i class="fas fa-fingerprint"></i> Checksums
+            </button>
             <span id="selected-count">0 items selected</span>
         </div>''')
         r.append('        <table class="files-table">')
@@ -965,105 +4371,80 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
                 <th onclick="sortTable(3)">Size <i class="fas fa-sort"></i></th>
                 <th class="date" onclick="sortTable(4)">Last Modified <i class="fas fa-sort"></i></th>
             </tr>''')
+        return r
 
-        for name in list:
-            fullname = os.path.join(path, name)
-            displayname = linkname = name
-            file_type = ""
-            
-            if os.path.isdir(fullname):
-                displayname = name
-                linkname = name + '/'
-                icon_class = 'folder'
-                icon = '<i class="fas fa-folder file-icon"></i>'
-                file_type = "Directory"
-                total_size = 0
-                for dirpath, dirnames, filenames in os.walk(fullname):
-                    for f in filenames:
-                        fp = os.path.join(dirpath, f)
-                        try:
-                            total_size += os.path.getsize(fp)
-                        except OSError:
-                            pass
-                size = total_size
-                size_str = self._format_size(size)
-            else:
-                icon_class = 'file'
-                ext = os.path.splitext(name)[1].lower()
-                if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-                    icon = '<i class="fas fa-image file-icon"></i>'
-                    file_type = "Image"
-                elif ext in ['.mp3', '.wav', '.ogg']:
-                    icon = '<i class="fas fa-music file-icon"></i>'
-                    file_type = "Audio"
-                elif ext in ['.mp4', '.avi', '.mkv', '.mov']:
-                    icon = '<i class="fas fa-video file-icon"></i>'
-                    file_type = "Video"
-                elif ext in ['.pdf']:
-                    icon = '<i class="fas fa-file-pdf file-icon"></i>'
-                    file_type = "PDF"
-                elif ext in ['.doc', '.docx']:
-                    icon = '<i class="fas fa-file-word file-icon"></i>'
-                    file_type = "Word"
-                elif ext in ['.xls', '.xlsx']:
-                    icon = '<i class="fas fa-file-excel file-icon"></i>'
-                    file_type = "Excel"
-                elif ext in ['.zip', '.rar', '.7z', '.tar', '.gz']:
-                    icon = '<i class="fas fa-file-archive file-icon"></i>'
-                    file_type = "Archive"
-                elif ext in ['.txt', '.md']:
-                    icon = '<i class="fas fa-file-alt file-icon"></i>'
-                    file_type = "Text"
-                elif ext in ['.py', '.js', '.html', '.css', '.php', '.java', '.cpp']:
-                    icon = '<i class="fas fa-file-code file-icon"></i>'
-                    file_type = "Code"
-                else:
-                    icon = '<i class="fas fa-file file-icon"></i>'
-                    file_type = ext[1:].upper() if ext else "File"
-                try:
-                    size = os.path.getsize(fullname)
-                    size_str = self._format_size(size)
-                except OSError:
-                    size = 0
-                    size_str = '???'
-                
-            if os.path.islink(fullname):
-                displayname = name
-                icon = '<i class="fas fa-link file-icon"></i>'
-                file_type = "Link"
-                
-            try:
-                mtime = os.path.getmtime(fullname)
-                mtime_str = self._format_date(mtime)
-            except OSError:
-                mtime_str = '???'
-                
-            checkbox = '<input type="checkbox" name="file-select" value="{}" onclick="updateSelectedCount()">'.format(fullname)
-            
-            r.append('            <tr class="{}-row">'.format(icon_class))
-            r.append('                <td class="checkbox-column">{}</td>'.format(checkbox))
-            r.append('                <td class="name-column"><a href="{}" class="{}">{}{}</a></td>'.format(linkname, icon_class, icon, displayname))
-            r.append('                <td class="type">{}</td>'.format(file_type))
-            r.append('                <td class="size" data-size="{}">{}</td>'.format(size, size_str))
-            r.append('                <td class="date">{}</td>'.format(mtime_str))
-            r.append('            </tr>')
-            
-        r.append('        </table>')
+    def _listing_tail(self, next_key, total):
+        """Lines of the listing page after the rows: next_key is the cursor of the second page"""
+        r = ['        </table>']
+        if next_key is not None:
+            r.append('        <div id="listing-more" data-next-cursor="{}" data-total="{}">Loading more files...</div>'.format(
+                encode_cursor(next_key), total))
         r.append('    </div>')
         r.append('''    <div style="text-align: center; padding: 20px; margin-top: 40px; color: var(--text-color); border-top: 1px solid var(--border-color);">
         Made by <a href="https://github.com/PAPAMICA" style="color: var(--accent-color); text-decoration: none;">Mickael Asseline</a> with ♥️ - <a href="https://github.com/PAPAMICA/sshtools" style="color: var(--accent-color); text-decoration: none;">SSHTools</a>
     </div>''')
         r.append('</body>')
         r.append('</html>')
-        
-        encoded = '\n'.join(r).encode('utf-8', 'replace')
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.send_header('Content-Length', str(len(encoded)))
-        self.end_headers()
-        self.wfile.write(encoded)
-        return None
-        
+        return r
+
+    def _render_row(self, entry):
+        """Return the table row lines for a ListingEntry"""
+        if entry.is_dir:
+            linkname = entry.name + '/'
+            icon_class = 'folder'
+        else:
+            linkname = entry.name
+            icon_class = 'file'
+        icon = '<i class="fas {} file-icon"></i>'.format(entry.icon)
+        size_str = '???' if entry.size is None else self._format_size(entry.size)
+        mtime_str = '???' if entry.mtime is None else self._format_date(entry.mtime)
+        checkbox = '<input type="checkbox" name="file-select" value="{}" onclick="updateSelectedCount()">'.format(entry.path)
+        return [
+            '            <tr class="{}-row">'.format(icon_class),
+            '                <td class="checkbox-column">{}</td>'.format(checkbox),
+            '                <td class="name-column"><a href="{}" class="{}">{}{}</a></td>'.format(linkname, icon_class, icon, entry.name),
+            '                <td class="type">{}</td>'.format(entry.file_type),
+            '                <td class="size" data-size="{}">{}</td>'.format(entry.size or 0, size_str),
+            '                <td class="date">{}</td>'.format(mtime_str),
+            '            </tr>',
+        ]
+
+    def _sizes_cached(self, dir_entries):
+        """Whether the sizes of the subdirectories among dir_entries are known without walking them"""
+        for dir_entry in dir_entries:
+            try:
+                if not dir_entry.is_dir():
+                    continue
+                st = dir_entry.stat()
+            except OSError:
+                continue
+            if self.size_index is None or not self.size_index.cached(dir_entry.path, st):
+                return False
+        return True
+
+    def _directory_size(self, path, st=None):
+        start = time.perf_counter()
+        try:
+            return self._compute_directory_size(path, st)
+        finally:
+            METRICS.observe_walk('dir_size', time.perf_counter() - start)
+
+    def _compute_directory_size(self, path, st=None):
+        if self.size_index is not None:
+            try:
+                return self.size_index.size(path, st)
+            except OSError as e:
+                self.log_error("Size index lookup failed for %s: %s", path, e)
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                try:
+                    total_size += os.path.getsize(fp)
+                except OSError:
+                    pass
+        return total_size
+
     def _format_size(self, size):
         for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
             if size < 1024:
@@ -1074,52 +4455,618 @@ class FileUploadHandler(SimpleHTTPRequestHandler):
         return '%.1f TB' % size
         
     def _format_date(self, timestamp):
-        from datetime import datetime
         return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
-def main():
-    if len(sys.argv) > 1:
+class PooledTCPServer(TCPServer):
+    """TCPServer handing accepted connections to a bounded pool of worker threads"""
+    allow_reuse_address = True
+    # Kernel accept backlog: the default of 5 drops SYNs during bursts,
+    # which clients only retry after a second
+    request_queue_size = 128
+
+    def __init__(self, server_address, RequestHandlerClass, workers=16, queue_size=64, bind_and_activate=True):
+        self.request_queue = Queue()
+        # Connections being served plus connections waiting for a worker
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.workers = []
+        TCPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate)
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker, name='webshare-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        if self.slots.acquire(False):
+            self.request_queue.put((request, client_address))
+        else:
+            # All workers busy and backlog full: refuse instead of piling up
+            METRICS.reject()
+            try:
+                request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                                b'Retry-After: 1\r\n'
+                                b'Content-Length: 0\r\n'
+                                b'Connection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def busy(self):
+        """Whether accepted connections are waiting for a worker"""
+        return not self.request_queue.empty()
+
+    def _worker(self):
+        while True:
+            item = self.request_queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.slots.release()
+
+    def server_close(self):
+        TCPServer.server_close(self)
+        for _ in self.workers:
+            self.request_queue.put(None)
+
+class PreforkWorker(object):
+    """A pre-fork worker process's view of its own lifecycle.
+
+    After max_requests requests it calls recycle() to have the supervisor
+    start its replacement. SIGTERM from the supervisor stops the accept
+    loop; the worker then serves the connections already queued on its
+    socket, closes it and gives the requests in flight up to grace_timeout
+    seconds, answering them with Connection: close.
+    """
+
+    def __init__(self, number, max_requests=0, recycle=None):
+        self.number = number
+        self.max_requests = max_requests
+        self.recycle = recycle
+        self.served = 0
+        self.lock = threading.Lock()
+        self.draining = False
+        self.httpd = None
+
+    def request_done(self):
+        with self.lock:
+            self.served += 1
+            if self.served != self.max_requests:
+                return
+        self.recycle()
+
+    def stop(self, *signal_args):
+        """Make serve() return; usable as a signal handler"""
+        if not self.draining:
+            self.draining = True
+            # shutdown() waits for serve_forever() to return: not from its thread
+            thread = threading.Thread(target=self.httpd.shutdown, name='webshare-stop')
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, httpd, grace_timeout):
+        self.httpd = httpd
+        signal.signal(signal.SIGTERM, self.stop)
+        httpd.serve_forever()
+        self.draining = True
+        # With SO_REUSEPORT, connections queued on this socket are not handed
+        # to the other workers when it closes: accept them first
+        httpd.timeout = 0
+        while select.select([httpd.socket], [], [], 0)[0]:
+            httpd.handle_request()
+        httpd.server_close()
+        deadline = time.monotonic() + grace_timeout
+        for thread in getattr(httpd, 'workers', ()):
+            thread.join(max(0, deadline - time.monotonic()))
+
+class PreforkSupervisor(object):
+    """Keeps processes forked workers serving the port, replacing recycled and dead ones.
+
+    run_worker(number, ready, recycle) is the body of each worker; SIGHUP recycles them all.
+    """
+
+    def __init__(self, run_worker, processes, grace_timeout=30, start_timeout=30):
+        self.run_worker = run_worker
+        self.processes = processes
+        self.grace_timeout = grace_timeout
+        self.start_timeout = start_timeout
+        self.workers = {}      # pid -> (worker number, start time)
+        self.retiring = set()  # pids of stopping workers, not replaced
+        self.recycle_requested = False
+        # Workers write their pid here to ask for a replacement
+        self.recycle_read, self.recycle_write = os.pipe()
+
+    def spawn(self, number):
+        """Fork worker number and wait until it listens, False if it did not"""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            # Ctrl+C reaches the whole process group: the supervisor decides what stops
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+            def ready():
+                os.write(ready_write, b'.')
+                os.close(ready_write)
+
+            def recycle():
+                # Shorter than PIPE_BUF: written atomically
+                os.write(self.recycle_write, struct.pack('=i', os.getpid()))
+            status = 1
+            try:
+                self.run_worker(number, ready, recycle)
+                status = 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                os._exit(status)
+        os.close(ready_write)
+        self.workers[pid] = (number, time.monotonic())
         try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print(f"Error: Invalid port number '{sys.argv[1]}'")
-            sys.exit(1)
+            if select.select([ready_read], [], [], self.start_timeout)[0]:
+                return os.read(ready_read, 1) == b'.'
+            return False
+        finally:
+            os.close(ready_read)
+
+    def start(self):
+        """Start every worker, False if none of them could listen"""
+        signal.signal(signal.SIGHUP, self._request_recycle)
+        started = [self.spawn(number) for number in range(1, self.processes + 1)]
+        return any(started)
+
+    def run(self):
+        """Supervise until interrupted"""
+        while True:
+            if self.recycle_requested:
+                self.recycle_requested = False
+                self.recycle()
+            self.reap()
+            if select.select([self.recycle_read], [], [], 0.2)[0]:
+                data = os.read(self.recycle_read, 4096)
+                for pid, in struct.iter_unpack('=i', data[:len(data) // 4 * 4]):
+                    if pid in self.workers:
+                        self.replace(pid)
+
+    def _request_recycle(self, *signal_args):
+        self.recycle_requested = True
+
+    def recycle(self):
+        print(f"♻️  Recycling {len(self.workers)} worker processes")
+        for pid in list(self.workers):
+            if pid in self.workers:
+                self.replace(pid)
+
+    def replace(self, pid):
+        """Start a new worker in place of pid, then stop pid gracefully"""
+        number = self.workers[pid][0]
+        if self.spawn(number):
+            self.retire(pid)
+        else:
+            print(f"⚠️  Replacement for worker {number} did not start, keeping pid {pid}")
+
+    def retire(self, pid):
+        del self.workers[pid]
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.retiring.discard(pid)
+
+    def reap(self):
+        """Collect exited workers and start replacements for those that were not retired"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if pid not in self.workers:
+                continue
+            number, started = self.workers.pop(pid)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            if code:
+                print(f"⚠️  Worker {number} (pid {pid}) exited with status {code}, restarting it")
+                if time.monotonic() - started < 1:
+                    # Failing right away: do not fork in a tight loop
+                    time.sleep(1)
+            self.spawn(number)
+
+    def stop(self):
+        """Stop every worker gracefully, killing those still busy after the grace timeout"""
+        pids = set(self.workers) | self.retiring
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.grace_timeout + 5
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        pids.discard(pid)
+                except ChildProcessError:
+                    pids.discard(pid)
+            time.sleep(0.05)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+        self.retiring.clear()
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='WebShare - share the current directory over HTTP')
+    parser.add_argument('port', nargs='?', default='8000',
+                        help='port to listen on (default: 8000)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker threads serving requests concurrently '
+                             '(default: 0, serve one request at a time)')
+    parser.add_argument('--processes', type=int, nargs='?', default=1, const=os.cpu_count() or 1, metavar='N',
+                        help='serve from N forked processes sharing the port with SO_REUSEPORT, each with '
+                             '--workers threads (N defaults to the number of CPUs; default: 1 process)')
+    parser.add_argument('--process-max-requests', type=int, default=0, metavar='N',
+                        help='replace a worker process after it served N requests, 0 for never (default: 0)')
+    parser.add_argument('--graceful-timeout', type=float, default=30, metavar='SECONDS',
+                        help='time a stopping worker process gets to finish its requests (default: 30)')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='maximum number of accepted connections waiting for a worker '
+                             'before new ones are refused with 503 (default: 64)')
+    parser.add_argument('--search-interval', type=int, default=60, metavar='SECONDS',
+                        help='how often the recursive search index checks for changes, '
+                             '0 to disable recursive search (default: 60)')
+    parser.add_argument('--keepalive-timeout', type=float, default=15, metavar='SECONDS',
+                        help='close connections idle for this long (default: 15)')
+    parser.add_argument('--keepalive-requests', type=int, default=100, metavar='N',
+                        help='requests served per connection, 1 disables keep-alive (default: 100)')
+    parser.add_argument('--limit-down', default='0', metavar='RATE',
+                        help='total download bandwidth, e.g. 50M (bytes/s, default: unlimited)')
+    parser.add_argument('--limit-up', default='0', metavar='RATE',
+                        help='total upload bandwidth (default: unlimited)')
+    parser.add_argument('--client-limit-down', default='0', metavar='RATE',
+                        help='download bandwidth of each client address (default: unlimited)')
+    parser.add_argument('--client-limit-up', default='0', metavar='RATE',
+                        help='upload bandwidth of each client address (default: unlimited)')
+    parser.add_argument('--zip-level', type=int, default=6, choices=range(10), metavar='0-9',
+                        help='deflate level of ZIP and tar.gz downloads, 0 to store files uncompressed (default: 6)')
+    parser.add_argument('--zip-threads', type=int, metavar='N',
+                        help='threads compressing ZIP and tar.gz downloads, in each process '
+                             '(default: number of CPUs divided by --processes)')
+    parser.add_argument('--access-log', metavar='PATH',
+                        help='write a JSON-lines access log with timings to PATH')
+    parser.add_argument('--access-log-max-size', type=int, default=100, metavar='MB',
+                        help='rotate the access log when it reaches this size (default: 100)')
+    parser.add_argument('--access-log-backups', type=int, default=5, metavar='N',
+                        help='rotated access logs to keep (default: 5)')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='profile requests and write aggregated stats per route to DIR')
+    parser.add_argument('--profile-mode', choices=('cprofile', 'sample'), default='cprofile',
+                        help='cprofile (exact, one request at a time) or sample (stack sampling, low overhead)')
+    parser.add_argument('--profile-routes', metavar='ROUTES',
+                        help='comma-separated routes to keep, e.g. listing,file,upload,zip,tar,api_list (default: all)')
+    parser.add_argument('--profile-every', type=int, default=1, metavar='N',
+                        help='profile one request out of N (default: 1)')
+    parser.add_argument('--profile-interval', type=float, default=5, metavar='MS',
+                        help='sampling interval in sample mode (default: 5)')
+    parser.add_argument('--no-sendfile', action='store_true',
+                        help='copy file downloads through userspace instead of using os.sendfile')
+    parser.add_argument('--size-index', default=default_size_index_path(), metavar='PATH',
+                        help='SQLite file caching directory sizes across restarts, '
+                             '"off" to walk directories on every listing (default: %(default)s)')
+    parser.add_argument('--checksum-cache', default=default_checksum_cache_path(), metavar='PATH',
+                        help='SQLite file caching file checksums across restarts, '
+                             '"off" to hash files on every request (default: %(default)s)')
+    parser.add_argument('--hash-threads', type=int, metavar='N',
+                        help='threads hashing files for the checksums API, in each process '
+                             '(default: number of CPUs divided by --processes)')
+    args = parser.parse_args()
+    try:
+        args.port = int(args.port)
+    except ValueError:
+        print(f"Error: Invalid port number '{args.port}'")
+        sys.exit(1)
+    if args.keepalive_timeout <= 0 or args.keepalive_requests < 1:
+        print("Error: --keepalive-timeout must be > 0 and --keepalive-requests >= 1")
+        sys.exit(1)
+    FileUploadHandler.keepalive_timeout = args.keepalive_timeout
+    # Without a worker pool an idle connection would block every other client
+    FileUploadHandler.keepalive_requests = args.keepalive_requests if args.workers else 1
+    try:
+        FileUploadHandler.limiter.configure({
+            'down': args.limit_down,
+            'up': args.limit_up,
+            'client_down': args.client_limit_down,
+            'client_up': args.client_limit_up,
+        })
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.zip_threads is not None and args.zip_threads < 1:
+        print("Error: --zip-threads must be >= 1")
+        sys.exit(1)
+    FileUploadHandler.zip_level = args.zip_level
+    if args.no_sendfile:
+        FileUploadHandler.use_sendfile = False
+    if args.search_interval < 0:
+        print("Error: --search-interval must be >= 0")
+        sys.exit(1)
+    if args.size_index == 'off':
+        args.size_index = None
+    if args.checksum_cache == 'off':
+        args.checksum_cache = None
+    if args.hash_threads is not None and args.hash_threads < 1:
+        print("Error: --hash-threads must be >= 1")
+        sys.exit(1)
+    if args.profile_every < 1 or args.profile_interval <= 0:
+        print("Error: --profile-every must be >= 1 and --profile-interval > 0")
+        sys.exit(1)
+    if args.access_log_max_size < 1 or args.access_log_backups < 0:
+        print("Error: --access-log-max-size must be >= 1 and --access-log-backups >= 0")
+        sys.exit(1)
+    if args.workers < 0 or args.queue_size < 1:
+        print("Error: --workers must be >= 0 and --queue-size must be >= 1")
+        sys.exit(1)
+    if args.processes < 1 or args.process_max_requests < 0 or args.graceful_timeout < 0:
+        print("Error: --processes must be >= 1, --process-max-requests and --graceful-timeout >= 0")
+        sys.exit(1)
+    if args.processes > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        print("Error: --processes needs os.fork and SO_REUSEPORT, which this platform lacks")
+        sys.exit(1)
+    # Processes share the CPUs: by default each one gets its part of them
+    cpu_share = max((os.cpu_count() or 1) // args.processes, 1)
+    FileUploadHandler.zip_threads = args.zip_threads or cpu_share
+    FileUploadHandler.hash_threads = args.hash_threads or cpu_share
+    return args
+
+# ioctl asking Linux for the IPv4 address of an interface (struct ifreq in, ifreq out)
+SIOCGIFADDR = 0x8915
+
+def interface_addresses():
+    """Non-loopback IPv4 addresses of this host, without forking ifconfig"""
+    addresses = []
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                request = struct.pack('256s', name.encode('utf-8')[:15])
+                try:
+                    reply = fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)
+                except OSError:  # Interface down or without an IPv4 address
+                    continue
+                address = socket.inet_ntoa(reply[20:24])
+                if not address.startswith('127.') and address not in addresses:
+                    addresses.append(address)
+    except (AttributeError, OSError):  # Not Linux, or fcntl is None
+        pass
+    if not addresses:
+        # Connecting a UDP socket sends nothing but picks the outgoing interface
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(('192.0.2.1', 9))
+                address = s.getsockname()[0]
+            if not address.startswith('127.'):
+                addresses.append(address)
+        except OSError:
+            pass
+    return addresses
+
+def setup_handler(Handler, args, worker=None):
+    """Set up the per-process state of the handler.
+
+    In pre-fork mode every worker process does this after the fork (SQLite
+    connections and threads do not survive it) and writes its own access
+    log and profiles, numbered after the worker.
+    """
+    try:
+        import sqlite3
+    except ImportError:  # Python built without sqlite support
+        sqlite3 = None
+    if args.size_index and sqlite3 is not None:
+        try:
+            Handler.size_index = DirSizeIndex(cache_path(args.size_index))
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Directory size index disabled: {e}")
+    if args.checksum_cache and sqlite3 is not None:
+        try:
+            Handler.checksum_cache = ChecksumCache(cache_path(args.checksum_cache))
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Checksum cache disabled: {e}")
+    try:
+        Handler.uploads = UploadSessions(default_upload_state_dir(), os.getcwd())
+    except OSError as e:
+        print(f"⚠️  Resumable uploads disabled: {e}")
+    if args.profile:
+        routes = [route.strip() for route in (args.profile_routes or '').split(',') if route.strip()]
+        directory = args.profile if worker is None else os.path.join(args.profile, 'worker-%d' % worker)
+        try:
+            Handler.profiler = RequestProfiler(directory, args.profile_mode, routes,
+                                               args.profile_every, args.profile_interval / 1000.0)
+        except OSError as e:
+            print(f"⚠️  Profiling disabled: {e}")
+    if args.access_log:
+        path = args.access_log
+        if worker is not None:
+            root, ext = os.path.splitext(path)
+            path = '%s.%d%s' % (root, worker, ext)
+        try:
+            Handler.access_log = AccessLog(path, args.access_log_max_size * 1024 * 1024, args.access_log_backups)
+        except OSError as e:
+            print(f"⚠️  Access log disabled: {e}")
+
+def close_handler(Handler):
+    """Flush what the handler's per-process state still holds"""
+    if Handler.access_log is not None:
+        Handler.access_log.close()
+    if Handler.profiler is not None:
+        Handler.profiler.close()
+
+def make_server(Handler, args, reuse_port=False):
+    """Bind and listen on args.port, with a worker thread pool if args.workers"""
+    if args.workers:
+        httpd = PooledTCPServer(('', args.port), Handler, workers=args.workers, queue_size=args.queue_size,
+                                bind_and_activate=False)
     else:
-        port = 8000
+        httpd = TCPServer(('', args.port), Handler, bind_and_activate=False)
+    try:
+        if reuse_port:
+            httpd.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        httpd.server_bind()
+        httpd.server_activate()
+    except BaseException:
+        httpd.server_close()
+        raise
+    return httpd
+
+def write_control_token(port):
+    """Generate the limits API token and save it where only this user can read it; return (token, path)"""
+    token = base64.urlsafe_b64encode(os.urandom(24)).decode('ascii')
+    path = os.path.join(private_directory(default_cache_dir()), 'control-%d.token' % port)
+    fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    os.replace(path + '.tmp', path)
+    return token, path
+
+def print_banner(args, Handler, token_path=None):
+    print(f"\n🌐 Web File Server started")
+    print(f"📂 Sharing directory: {os.getcwd()}")
+    print(f"🔌 Available on:")
+    print(f"   • Local:   http://localhost:{args.port}")
+    for ip in interface_addresses():
+        print(f"   • Network: http://{ip}:{args.port}")
+    if args.processes > 1:
+        print(f"🧩 Processes: {args.processes} (SO_REUSEPORT, kill -HUP {os.getpid()} recycles them)")
+    if args.workers:
+        print(f"⚙️  Workers: {args.workers} (queue: {args.queue_size})")
+    limits = dict((name, value) for name, value in Handler.limiter.limits.items() if value)
+    if limits:
+        print("🚦 Bandwidth limits (bytes/s): " + ', '.join('%s=%d' % item for item in sorted(limits.items()))
+              + (f", split between the {args.processes} processes" if args.processes > 1 else ''))
+    if token_path:
+        print(f"🔑 Limits API token: {token_path}")
+    if Handler.access_log is not None:
+        print(f"📝 Access log: {Handler.access_log.path}")
+    elif args.access_log and args.processes > 1:
+        root, ext = os.path.splitext(os.path.abspath(args.access_log))
+        print(f"📝 Access logs: {root}.<worker>{ext}")
+    if Handler.profiler is not None:
+        print(f"🔬 Profiling ({args.profile_mode}) to: {Handler.profiler.directory}")
+    elif args.profile and args.processes > 1:
+        print(f"🔬 Profiling ({args.profile_mode}) to: {os.path.abspath(args.profile)}/worker-<worker>")
+    print("\n💡 Press Ctrl+C to stop the server\n")
+
+def run_worker(args, number, ready, recycle):
+    """Body of pre-fork worker process number: serve until told to stop"""
+    Handler = FileUploadHandler
+    Handler.worker = worker = PreforkWorker(number, args.process_max_requests, recycle)
+    Handler.limiter.split(args.processes)
+    setup_handler(Handler, args, number)
+    try:
+        httpd = make_server(Handler, args, reuse_port=True)
+        ready()
+        if args.search_interval:
+            # Started by the first search: every worker walking the tree up front would be N walks for nothing
+            Handler.filename_index = FilenameIndex(os.getcwd(), args.search_interval)
+        worker.serve(httpd, args.graceful_timeout)
+    finally:
+        close_handler(Handler)
+
+def run_prefork(args):
+    """Supervise args.processes worker processes until Ctrl+C or SIGTERM"""
+    # Holds the port while workers come and go; the workers' SO_REUSEPORT
+    # sockets join it, and as it never listens it gets no connections
+    reservation = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        # A plain bind first: SO_REUSEPORT alone would let this server share
+        # the port with another one started by the same user
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            probe.bind(('', args.port))
+        reservation.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        reservation.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        reservation.bind(('', args.port))
+    except OSError as e:
+        if e.errno == 98:
+            print(f"\n❌ Error: Port {args.port} is already in use")
+        else:
+            print(f"\n❌ Error: {e}")
+        sys.exit(1)
+    supervisor = PreforkSupervisor(lambda number, ready, recycle: run_worker(args, number, ready, recycle),
+                                   args.processes, args.graceful_timeout)
+    try:
+        if not supervisor.start():
+            print(f"\n❌ Error: no worker process could start listening on port {args.port}")
+            supervisor.stop()
+            sys.exit(1)
+        print_banner(args, FileUploadHandler)
+        supervisor.run()
+    except KeyboardInterrupt:
+        print('\n👋 Shutting down server...')
+        supervisor.stop()
+    finally:
+        reservation.close()
+    sys.exit(0)
+
+def main():
+    args = parse_args()
 
     Handler = FileUploadHandler
     TCPServer.allow_reuse_address = True
-    
+    # The webshare shell function stops the server with SIGTERM: shut down as for Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if args.processes > 1:
+        run_prefork(args)
+    setup_handler(Handler, args)
+
+    httpd = token_path = None
     try:
-        httpd = TCPServer(('', port), Handler)
-        
-        # Get IP addresses using shell command
-        import subprocess
-        cmd = "ifconfig 2>/dev/null | grep 'inet ' | grep -v '127.0.0.1' | awk '{print $2}'"
-        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, _ = process.communicate()
-        addresses = output.decode().strip().split('\n')
-        addresses = [addr for addr in addresses if addr]  # Filter out empty strings
-        
-        print(f"\n🌐 Web File Server started")
-        print(f"📂 Sharing directory: {os.getcwd()}")
-        print(f"🔌 Available on:")
-        print(f"   • Local:   http://localhost:{port}")
-        for ip in addresses:
-            print(f"   • Network: http://{ip}:{port}")
-        print("\n💡 Press Ctrl+C to stop the server\n")
-        
+        httpd = make_server(Handler, args)
+        # Once the port is ours: a second server on it must not replace the token
+        try:
+            Handler.control_token, token_path = write_control_token(args.port)
+        except OSError as e:
+            print(f"⚠️  Runtime limit changes disabled: {e}")
+        print_banner(args, Handler, token_path)
+        if args.search_interval:
+            # The first walk competes with the first requests, not with startup
+            Handler.filename_index = FilenameIndex(os.getcwd(), args.search_interval).start()
         httpd.serve_forever()
     except OSError as e:
         if e.errno == 98:
-            print(f"\n❌ Error: Port {port} is already in use")
+            print(f"\n❌ Error: Port {args.port} is already in use")
         else:
             print(f"\n❌ Error: {e}")
         sys.exit(1)
     except KeyboardInterrupt:
         print('\n👋 Shutting down server...')
-        httpd.shutdown()
-        httpd.server_close()
+        # serve_forever() ran in this thread and has returned, or never started when the
+        # signal came during startup: shutdown() would wait for it forever
+        if httpd is not None:
+            httpd.server_close()
+        close_handler(Handler)
+        if token_path:
+            try:
+                os.remove(token_path)
+            except OSError:
+                pass
         sys.exit(0)
 
 if __name__ == '__main__':
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""End-to-end HTTP load benchmark for webshare.
+
+Builds a synthetic tree, starts .webshare.py on localhost in it, with the
+options of the webshare shell function and caches of its own, and drives
+concurrent clients against directory listings, file downloads, /upload and
+/download-selected. The report (throughput, p50/p99 latency, peak server
+RSS, launch-to-first-accept time) is printed as JSON so that runs can be compared before and after a
+change:
+
+    python3 .webshare_bench.py --output before.json
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+
+SCENARIOS = ('listing', 'get-small', 'get-huge', 'upload', 'download-selected')
+
+# What the webshare shell function runs with by default
+DEPLOYED_ARGS = ['--workers', '16', '--queue-size', '64']
+
+def build_tree(root, wide=10000, depth=40, small=2000, huge=2, huge_size=128 * 1024 * 1024):
+    """Create the synthetic tree under root and return what the clients need from it"""
+    tree = {'listing': [], 'small': [], 'huge': [], 'selection': []}
+
+    # Wide flat directory
+    wide_dir = os.path.join(root, 'wide')
+    os.makedirs(wide_dir)
+    for i in range(wide):
+        with open(os.path.join(wide_dir, 'file-%06d.txt' % i), 'w') as f:
+            f.write('%d\n' % i)
+    tree['listing'].append('/wide/')
+
+    # Deeply nested directories, a few files at each level
+    path = os.path.join(root, 'deep')
+    url = '/deep/'
+    for level in range(depth):
+        path = os.path.join(path, 'level-%02d' % level)
+        url += 'level-%02d/' % level
+        os.makedirs(path)
+        for i in range(5):
+            with open(os.path.join(path, 'file-%d.txt' % i), 'w') as f:
+                f.write('level %d file %d\n' % (level, i))
+        tree['listing'].append(url)
+
+    # Many small files spread over a few directories
+    for i in range(small):
+        name = 'small/dir-%02d/file-%05d.txt' % (i % 20, i)
+        full_path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            # Half text, half random: both compression paths get exercised
+            if i % 2:
+                f.write(os.urandom(4096))
+            else:
+                f.write((b'%05d lorem ipsum dolor sit amet\n' % i) * 128)
+        tree['small'].append('/' + name)
+    tree['listing'].append('/small/dir-00/')
+    tree['selection'] = [os.path.join(root, 'small', 'dir-%02d' % i) for i in range(4)]
+
+    # A few huge files of random data
+    block = os.urandom(1024 * 1024)
+    for i in range(huge):
+        name = 'huge-%d.bin' % i
+        with open(os.path.join(root, name), 'wb') as f:
+            for _ in range(huge_size // len(block)):
+                f.write(block)
+            f.write(block[:huge_size % len(block)])
+        tree['huge'].append('/' + name)
+
+    return tree
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# What the webshare shell function runs: the script's bytecode is cached in argv[2]
+CACHED_LAUNCHER = """
+import sys, importlib.machinery
+script, sys.pycache_prefix = sys.argv[1:3]
+sys.argv = [script] + sys.argv[3:]
+code = importlib.machinery.SourceFileLoader("__main__", script).get_code("__main__")
+sys.pycache_prefix = None
+exec(code, {"__name__": "__main__", "__file__": script, "__builtins__": __builtins__})
+"""
+
+class Server(object):
+    """A .webshare.py process serving root on localhost"""
+
+    def __init__(self, script, root, port, args, bytecode_cache=None, cache_dir=None):
+        self.port = port
+        command = [sys.executable, script, str(port)]
+        env = dict(os.environ)
+        if cache_dir:
+            # Size index, checksum cache, upload state and limits token: the
+            # server keeps them all there, the user's own caches stay untouched
+            env['XDG_CACHE_HOME'] = cache_dir
+        if bytecode_cache:
+            command = [sys.executable, '-c', CACHED_LAUNCHER, script, bytecode_cache, str(port)]
+            env.pop('PYTHONDONTWRITEBYTECODE', None)
+        self.process = subprocess.Popen(
+            command + list(args), cwd=root, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 30
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError('webshare exited with status %d' % self.process.returncode)
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.2).close()
+                return
+            except OSError:
+                if time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError('webshare did not start listening on port %d' % port)
+                time.sleep(0.002)
+
+    def peak_rss(self):
+        """Peak resident set size of the server in bytes, None where /proc is missing"""
+        try:
+            with open('/proc/%d/status' % self.process.pid) as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+def multipart_body(filename, data, boundary):
+    return b''.join([
+        b'--', boundary, b'\r\n',
+        b'Content-Disposition: form-data; name="file[]"; filename="', filename.encode('utf-8'), b'"\r\n',
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        data, b'\r\n--', boundary, b'--\r\n',
+    ])
+
+def make_request(scenario, tree, client, seq, upload_size):
+    """Return (method, url, body, headers) for one request of a scenario"""
+    if scenario == 'listing':
+        return 'GET', quote(random.choice(tree['listing'])), None, {}
+    if scenario == 'get-small':
+        return 'GET', quote(random.choice(tree['small'])), None, {}
+    if scenario == 'get-huge':
+        return 'GET', quote(random.choice(tree['huge'])), None, {}
+    if scenario == 'upload':
+        boundary = b'----webshare-bench-%d-%d' % (client, seq)
+        body = multipart_body('bench-uploads/%d-%d.bin' % (client, seq), os.urandom(upload_size), boundary)
+        return 'POST', '/upload', body, {'Content-Type': 'multipart/form-data; boundary=' + boundary.decode()}
+    if scenario == 'download-selected':
+        return 'POST', '/download-selected', json.dumps(tree['selection']).encode('utf-8'), {}
+    raise ValueError('Unknown scenario: %s' % scenario)
+
+def run_scenario(scenario, tree, port, concurrency, requests, upload_size):
+    """Run requests requests over concurrency client threads and summarize them"""
+    latencies = []
+    errors = [0]
+    transferred = [0, 0]  # bytes received, bytes sent
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client(client_id):
+        conn = None
+        while True:
+            with lock:
+                seq = next(counter, None)
+            if seq is None:
+                break
+            method, url, body, headers = make_request(scenario, tree, client_id, seq, upload_size)
+            start = time.perf_counter()
+            received = 0
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                conn.request(method, url, body, headers)
+                response = conn.getresponse()
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                ok = 200 <= response.status < 400
+                if response.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+                transferred[0] += received
+                transferred[1] += len(body or b'')
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        'requests': len(latencies) + errors[0],
+        'errors': errors[0],
+        'concurrency': concurrency,
+        'duration_s': round(duration, 3),
+        'requests_per_s': round(len(latencies) / duration, 2) if duration else None,
+        'received_mb_per_s': round(transferred[0] / duration / 1e6, 2) if duration else None,
+        'sent_mb_per_s': round(transferred[1] / duration / 1e6, 2) if duration else None,
+        'latency_ms': {
+            'p50': percentile(0.50),
+            'p99': percentile(0.99),
+            'max': round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+def measure_startup(script, root, args, runs, bytecode_cache=None, target_ms=100, cache_dir=None):
+    """Launch-to-first-accept time of the server over runs fresh processes"""
+    times = []
+    for _ in range(runs):
+        port = free_port()
+        start = time.perf_counter()
+        server = Server(script, root, port, args, bytecode_cache, cache_dir)
+        times.append(time.perf_counter() - start)
+        server.stop()
+    times.sort()
+    return {
+        'runs': runs,
+        'cached_bytecode': bool(bytecode_cache),
+        'min_ms': round(times[0] * 1000, 1),
+        'median_ms': round(times[len(times) // 2] * 1000, 1),
+        'max_ms': round(times[-1] * 1000, 1),
+        'target_ms': target_ms,
+        'within_target': times[len(times) // 2] * 1000 < target_ms,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark a local webshare server end to end')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients (default: 8)')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per scenario, a tenth of it for get-huge and download-selected (default: 500)')
+    parser.add_argument('--wide', type=int, default=10000, help='files in the wide directory (default: 10000)')
+    parser.add_argument('--depth', type=int, default=40, help='levels of the deep directory (default: 40)')
+    parser.add_argument('--small', type=int, default=2000, help='number of 4 KB files (default: 2000)')
+    parser.add_argument('--huge', type=int, default=2, help='number of huge files (default: 2)')
+    parser.add_argument('--huge-size', type=int, default=128, metavar='MB', help='size of huge files (default: 128)')
+    parser.add_argument('--upload-size', type=int, default=256, metavar='KB', help='size of uploaded files (default: 256)')
+    parser.add_argument('--startup-runs', type=int, default=10,
+                        help='server launches timed to first accepted connection, 0 to skip (default: 10)')
+    parser.add_argument('--root', help='build the tree here instead of a temporary directory (must not exist)')
+    parser.add_argument('--keep', action='store_true', help='keep the tree after the run')
+    parser.add_argument('--script', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.webshare.py'),
+                        help='webshare script to benchmark (default: .webshare.py next to this file)')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER,
+                        help='extra webshare arguments, after --, e.g. -- --workers 32 '
+                             '(default: %s, as the webshare shell function)' % ' '.join(DEPLOYED_ARGS))
+    args = parser.parse_args()
+    # The server runs in the tree: a relative script path would not resolve there
+    args.script = os.path.abspath(args.script)
+    if args.server_args[:1] == ['--']:
+        args.server_args = args.server_args[1:]
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %r (choose from %s)' % (name, ', '.join(SCENARIOS)))
+    if args.concurrency < 1 or args.requests < 1:
+        parser.error('--concurrency and --requests must be >= 1')
+    if args.startup_runs < 0:
+        parser.error('--startup-runs must be >= 0')
+    return args
+
+def main():
+    args = parse_args()
+    if args.root:
+        root = os.path.abspath(args.root)
+        os.makedirs(root)
+    else:
+        root = tempfile.mkdtemp(prefix='webshare-bench-')
+    # Size index, checksum cache and upload state of a fresh server, outside the tree
+    cache_dir = tempfile.mkdtemp(prefix='webshare-bench-cache-')
+    # Deployed defaults first, so the user's arguments win
+    extra_args = DEPLOYED_ARGS + list(args.server_args)
+
+    try:
+        print("🌳 Building the synthetic tree in %s..." % root, file=sys.stderr)
+        start = time.perf_counter()
+        tree = build_tree(root, args.wide, args.depth, args.small, args.huge, args.huge_size * 1024 * 1024)
+        build_time = time.perf_counter() - start
+
+        startup = {}
+        if args.startup_runs:
+            print("⏱️  startup: %d launches, plain and with cached bytecode..." % args.startup_runs, file=sys.stderr)
+            startup['plain'] = measure_startup(args.script, root, extra_args, args.startup_runs,
+                                               cache_dir=cache_dir)
+            bytecode_cache = tempfile.mkdtemp(prefix='webshare-bytecode-')
+            try:
+                startup['cached'] = measure_startup(args.script, root, extra_args, args.startup_runs,
+                                                    bytecode_cache, cache_dir=cache_dir)
+            finally:
+                shutil.rmtree(bytecode_cache, ignore_errors=True)
+
+        port = free_port()
+        print("🚀 Starting %s on port %d..." % (args.script, port), file=sys.stderr)
+        start = time.perf_counter()
+        server = Server(args.script, root, port, extra_args, cache_dir=cache_dir)
+        startup_time = time.perf_counter() - start
+        results = {}
+        try:
+            for name in args.scenarios:
+                requests = args.requests
+                if name in ('get-huge', 'download-selected'):
+                    requests = max(1, requests // 10)
+                print("⏱️  %s: %d requests, %d clients..." % (name, requests, args.concurrency), file=sys.stderr)
+                results[name] = run_scenario(name, tree, port, args.concurrency, requests,
+                                             args.upload_size * 1024)
+            peak_rss = server.peak_rss()
+        finally:
+            server.stop()
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {
+        'script': args.script,
+        'server_args': extra_args,
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'tree': {
+            'wide': args.wide,
+            'depth': args.depth,
+            'small': args.small,
+            'huge': args.huge,
+            'huge_size_mb': args.huge_size,
+            'build_s': round(build_time, 3),
+        },
+        'startup_s': round(startup_time, 3),
+        'startup': startup,
+        'server_peak_rss_mb': round(peak_rss / 1e6, 1) if peak_rss else None,
+        'scenarios': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print("📄 Report written to %s" % args.output, file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()